@@ -0,0 +1,144 @@
+"""Vectorized Table 1 evaluation of many positions at once (needs NumPy).
+
+encode() turns N positions into N x 52 arrays indexed by card id
+(card code - 4, i.e. (rank - 1) * 4 + suit): the tableau column and depth
+of each card, whether it is face down, can block, or is in a foundation.
+evaluate_batch() then computes all six features for every row with array
+operations. The blocking relations behind Features 5/6 are card-pair masks
+computed once (BLOCKS_SUITED, BLOCKS_BUILD) and combined with a per-row
+"x is above y in the same column" relation.
+
+    scores = evaluate_states(children, HeuristicType.H2)
+
+gives the same values as [Evaluator.evaluate(s, HeuristicType.H2) for s in
+children]. MultistageNestedRolloutSolver(batch_eval=True) uses it to score
+each set of leaf siblings in one call.
+"""
+from dataclasses import dataclass
+from typing import List, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+from main import (CompactSolitaireState, HeuristicType, WIN_VALUE,
+                  FACE_UP_BIT, CODE_MASK, _BUF_SIZE, _COL_CAP, _F_LEN,
+                  _T_BASE)
+
+if np is not None:
+    _IDS = np.arange(52)
+    _RANK = _IDS // 4 + 1
+    _SUIT = _IDS % 4
+    _RED = _SUIT < 2
+    # [x, y]: x blocks y when above it (Feature 5: suited card of lower rank;
+    # Feature 6: one of x's own build cards, other colour one rank higher)
+    BLOCKS_SUITED = ((_SUIT[:, None] == _SUIT[None, :])
+                     & (_RANK[:, None] > _RANK[None, :]))
+    BLOCKS_BUILD = ((_RANK[None, :] == _RANK[:, None] + 1)
+                    & (_RED[:, None] != _RED[None, :]))
+    # Per-card Feature 1 and 2 weights
+    _HOME_H1 = (6 - _RANK).astype(np.float64)
+    _DOWN = (_RANK - 14).astype(np.float64)
+
+
+@dataclass
+class StateBatch:
+    """N positions in array form; see encode()."""
+    col: 'np.ndarray'      # int8 N x 52: tableau column, -1 elsewhere
+    depth: 'np.ndarray'    # int8 N x 52: index in the column, bottom is 0
+    down: 'np.ndarray'     # bool N x 52: face down in the tableau
+    blocker: 'np.ndarray'  # bool N x 52: in the tableau, not on a face-up card
+    home: 'np.ndarray'     # bool N x 52: in a foundation
+    talon: 'np.ndarray'    # int16 N: cards reachable from the K+ talon (H2)
+
+    def __len__(self) -> int:
+        return len(self.col)
+
+
+def _slots(states: Sequence) -> Tuple['np.ndarray', 'np.ndarray']:
+    """Tableau card codes as an N x 7 x _COL_CAP uint8 array (0 = no card,
+    bottom card first) and foundation heights as N x 4."""
+    n = len(states)
+    if all(isinstance(s, CompactSolitaireState) for s in states):
+        raw = np.frombuffer(b''.join(s.buf for s in states),
+                            dtype=np.uint8).reshape(n, _BUF_SIZE)
+        tab = raw[:, _T_BASE:_T_BASE + 7 * _COL_CAP].reshape(n, 7, _COL_CAP)
+        return tab, raw[:, _F_LEN:_F_LEN + 4]
+    tab = np.zeros((n, 7, _COL_CAP), dtype=np.uint8)
+    heights = np.zeros((n, 4), dtype=np.uint8)
+    for r, state in enumerate(states):
+        for ci, col in enumerate(state.tableau):
+            tab[r, ci, :len(col)] = [c._code for c in col]
+        heights[r] = state.foundation_heights()
+    return tab, heights
+
+
+def encode(states: Sequence, talon: bool = True) -> StateBatch:
+    """Array layout of `states`. talon=False skips the K+ talon count,
+    which only H2 uses."""
+    if np is None:
+        raise ImportError('batch_eval needs NumPy')
+    n = len(states)
+    tab, heights = _slots(states)
+    present = tab != 0
+    up = (tab & FACE_UP_BIT) != 0
+    # A card blocks unless it rests on a face-up card
+    on_up = np.zeros_like(up)
+    on_up[:, :, 1:] = up[:, :, :-1]
+
+    # Scatter the occupied slots to their card ids
+    rows, cols, depths = np.nonzero(present)
+    ids = (tab[rows, cols, depths] & CODE_MASK).astype(np.intp) - 4
+    col = np.full((n, 52), -1, dtype=np.int8)
+    depth = np.zeros((n, 52), dtype=np.int8)
+    down = np.zeros((n, 52), dtype=bool)
+    blocker = np.zeros((n, 52), dtype=bool)
+    col[rows, ids] = cols
+    depth[rows, ids] = depths
+    down[rows, ids] = ~up[present]
+    blocker[rows, ids] = ~on_up[present]
+
+    home = _RANK[None, :] <= heights[:, _SUIT]
+    reach = np.zeros(n, dtype=np.int16)
+    if talon:
+        reach[:] = [len(s.get_reachable_talon_cards()) for s in states]
+    return StateBatch(col, depth, down, blocker, home, reach)
+
+
+def evaluate_batch(batch: StateBatch, h_type: HeuristicType) -> 'np.ndarray':
+    """Evaluator.evaluate() of every row, as a float64 array."""
+    is_h1 = h_type == HeuristicType.H1
+    w4, w5, w6 = (-5, -5, -10) if is_h1 else (-1, -1, -5)
+
+    # Features 1 and 2: per-card weights
+    if is_h1:
+        score = batch.home @ _HOME_H1
+    else:
+        score = 5.0 * batch.home.sum(axis=1) + batch.talon  # Feature 3
+    score += batch.down @ _DOWN
+
+    # Feature 4: both cards of a same-rank, same-colour pair face down
+    d = batch.down
+    pairs = ((d[:, 0::4] & d[:, 1::4]).sum(axis=1)
+             + (d[:, 2::4] & d[:, 3::4]).sum(axis=1))
+    score += w4 * pairs
+
+    # Features 5 and 6: [n, x, y] is x above y in the same column, x a blocker
+    col, depth = batch.col, batch.depth
+    above = ((col[:, :, None] == col[:, None, :]) & (col[:, :, None] >= 0)
+             & (depth[:, :, None] > depth[:, None, :])
+             & batch.blocker[:, :, None])
+    score += w5 * (above & BLOCKS_SUITED).sum(axis=(1, 2))
+    score += w6 * (above & BLOCKS_BUILD).sum(axis=(1, 2))
+
+    score[batch.home.all(axis=1)] = WIN_VALUE
+    return score
+
+
+def evaluate_states(states: Sequence, h_type: HeuristicType) -> List[float]:
+    """Evaluator.evaluate() of each state, computed as one batch."""
+    if not states:
+        return []
+    batch = encode(states, talon=h_type == HeuristicType.H2)
+    return evaluate_batch(batch, h_type).tolist()
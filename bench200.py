@@ -1,4 +1,4 @@
-import sys, time, random
+import sys, random
 from main import SolitaireState, MultistageNestedRolloutSolver
 
 wins = 0
@@ -11,7 +11,7 @@ for seed in range(total):
     game.deal_thoughtful(seed=seed)
     solver = MultistageNestedRolloutSolver(game, max_time=60, n0=1, n1=1)
     solution = solver.solve()
-    elapsed = time.time() - solver.start_time
+    elapsed = solver.deadline.elapsed()
     times.append(elapsed)
     won = solver.final_state.is_win()
     if won:
@@ -0,0 +1,228 @@
+"""Multi-process benchmark runner for MultistageNestedRolloutSolver.
+
+Solves a range of deal_thoughtful seeds on a process pool, prints each
+result as it completes and appends it to a JSON-lines results file.
+Re-running with the same results file skips seeds already recorded, so an
+interrupted run can be resumed. A summary (win rate with a 95% Wilson
+interval, time percentiles) is printed and optionally written as JSON,
+along with an optional per-seed CSV.
+
+    python bench_parallel.py --start 0 --count 200 --workers 32
+
+With --max-time 0 --max-nodes N every deal is searched to a fixed node
+budget, so wins and solutions are the same on every run and machine and
+only the times reflect performance.
+
+--store keeps results in an SQLite database shared across runs and results
+files: seeds already solved with the same solver settings are read back
+instead of searched (times are then those of the original solve).
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import sys
+
+from parallel import percentile, solve_many
+from solution_store import SolutionStore
+
+CSV_FIELDS = ['seed', 'win', 'time', 'fc', 'nodes', 'moves']
+
+
+def run_seeds(seeds, params: dict, workers: int, store=None):
+    """Yield a results-file record per seed as it finishes."""
+    for r in solve_many(
+            seeds, max_time=params['max_time'], n0=params['n0'], n1=params['n1'],
+            workers=workers, compact=params['compact'], store=store,
+            max_nodes=params['max_nodes'],
+            make_unmake=params['make_unmake'],
+            cache_capacity=params['cache_capacity'],
+            cache_policy=params['cache_policy'],
+            eval_cache_capacity=params['eval_cache'],
+            relaxed_prune=params['relaxed_prune'],
+            anytime=params['anytime'],
+            lazy_moves=not params['eager_moves'],
+            batch_eval=params['batch_eval'],
+            symmetric_cache=params['symmetric_cache'],
+            seed=params['solver_seed']):
+        yield {
+            'seed': r['seed'],
+            'win': r['win'],
+            'time': r['time'],
+            'fc': r['fc'],
+            'nodes': r['nodes'],
+            'moves': len(r['moves']),
+            'cached': r['cached'],
+            'params': params,
+        }
+
+
+def load_results(path: str, params: dict) -> dict:
+    """Results already in `path`, by seed. Refuses to mix solver params."""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn last line of an interrupted run
+            if rec.get('params') != params:
+                raise SystemExit(
+                    f"{path} holds results for {rec.get('params')}, "
+                    f"not {params}; use another --results file")
+            done[rec['seed']] = rec
+    return done
+
+
+def wilson_interval(wins: int, n: int, z: float = 1.96):
+    if n == 0:
+        return (0.0, 0.0)
+    p = wins / n
+    denom = 1 + z * z / n
+    centre = (p + z * z / (2 * n)) / denom
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denom
+    return (max(0.0, centre - half), min(1.0, centre + half))
+
+
+def summarize(results, params: dict) -> dict:
+    n = len(results)
+    wins = sum(1 for r in results if r['win'])
+    lo, hi = wilson_interval(wins, n)
+
+    def time_stats(rs):
+        ts = sorted(r['time'] for r in rs)
+        stats = {f'p{q}': round(percentile(ts, q), 3) for q in (50, 90, 95, 99)}
+        stats['mean'] = round(sum(ts) / len(ts), 3) if ts else 0.0
+        stats['max'] = ts[-1] if ts else 0.0
+        return stats
+
+    total_nodes = sum(r['nodes'] for r in results)
+    total_time = sum(r['time'] for r in results)
+    return {
+        'params': params,
+        'seeds': n,
+        'wins': wins,
+        'win_rate': wins / n if n else 0.0,
+        'win_rate_ci95': [lo, hi],
+        'time': time_stats(results),
+        'win_time': time_stats([r for r in results if r['win']]),
+        'loss_time': time_stats([r for r in results if not r['win']]),
+        'nodes_per_sec': round(total_nodes / total_time) if total_time else 0,
+    }
+
+
+def print_result(r: dict):
+    status = 'WIN' if r['win'] else 'LOSS'
+    print(f"Seed {r['seed']:3d}: {status} {r['time']:5.1f}s  fc={r['fc']:2d}  "
+          f"nodes={r['nodes']}{'  (stored)' if r.get('cached') else ''}",
+          flush=True)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--start', type=int, default=0, help='first seed')
+    ap.add_argument('--count', type=int, default=50, help='number of seeds')
+    ap.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    ap.add_argument('--max-time', type=float, default=60,
+                    help='seconds per deal; 0 for no time limit')
+    ap.add_argument('--max-nodes', type=int,
+                    help='also stop each solve after this many nodes')
+    ap.add_argument('--solver-seed', type=int, default=0,
+                    help='seed of the solver\'s move-order RNG')
+    ap.add_argument('--n0', type=int, default=1)
+    ap.add_argument('--n1', type=int, default=1)
+    ap.add_argument('--compact', action='store_true',
+                    help='use the CompactSolitaireState backend')
+    ap.add_argument('--make-unmake', action='store_true',
+                    help='search children with undo_move instead of clones')
+    ap.add_argument('--cache-capacity', type=int, default=5000,
+                    help='transposition table entries per heuristic level')
+    ap.add_argument('--cache-policy', choices=['lru', 'clock'], default='lru')
+    ap.add_argument('--eval-cache', type=int, default=20000,
+                    help='evaluation memo size (0 disables it)')
+    ap.add_argument('--relaxed-prune', type=int, metavar='LEVEL',
+                    help='prune relaxed dead ends at search levels >= LEVEL '
+                         '(the start position is always checked)')
+    ap.add_argument('--anytime', action='store_true',
+                    help='escalate nesting levels from (0,0) instead of --n0/--n1')
+    ap.add_argument('--eager-moves', action='store_true',
+                    help='generate all moves up front (get_ordered_moves)')
+    ap.add_argument('--batch-eval', action='store_true',
+                    help='score leaf siblings with NumPy (batch_eval.py)')
+    ap.add_argument('--symmetric-cache', action='store_true',
+                    help='share cache entries between suit-swapped positions')
+    ap.add_argument('--results', default='bench_results.jsonl',
+                    help='JSON-lines results file, appended to and resumed from')
+    ap.add_argument('--store', metavar='DB',
+                    help='SQLite solution store to reuse and extend')
+    ap.add_argument('--symmetric-store', action='store_true',
+                    help='key the store by canonical suit orientation')
+    ap.add_argument('--summary', help='write the summary as JSON to this path')
+    ap.add_argument('--csv', help='write per-seed results as CSV to this path')
+    args = ap.parse_args(argv)
+
+    if not args.max_time and args.max_nodes is None:
+        ap.error('--max-time 0 needs a --max-nodes budget')
+    params = {'max_time': args.max_time or None, 'max_nodes': args.max_nodes,
+              'n0': args.n0, 'n1': args.n1,
+              'compact': args.compact, 'make_unmake': args.make_unmake,
+              'cache_capacity': args.cache_capacity,
+              'cache_policy': args.cache_policy,
+              'eval_cache': args.eval_cache,
+              'relaxed_prune': args.relaxed_prune,
+              'anytime': args.anytime,
+              'eager_moves': args.eager_moves,
+              'batch_eval': args.batch_eval,
+              'symmetric_cache': args.symmetric_cache,
+              'solver_seed': args.solver_seed}
+    seeds = range(args.start, args.start + args.count)
+    done = load_results(args.results, params)
+    todo = [s for s in seeds if s not in done]
+    if len(todo) < len(seeds):
+        print(f'Resuming: {len(seeds) - len(todo)} of {len(seeds)} seeds already in '
+              f'{args.results}', flush=True)
+
+    store = args.store and SolutionStore(args.store,
+                                         symmetric=args.symmetric_store)
+    results = run_seeds(todo, params, args.workers, store)
+    try:
+        with open(args.results, 'a') as out:
+            for r in results:
+                out.write(json.dumps(r) + '\n')
+                out.flush()
+                done[r['seed']] = r
+                print_result(r)
+    except KeyboardInterrupt:
+        results.close()
+        print('\nInterrupted; re-run the same command to resume.', file=sys.stderr)
+        return 130
+
+    results = [done[s] for s in seeds if s in done]
+    summary = summarize(results, params)
+    lo, hi = summary['win_rate_ci95']
+    print(f"\nResult: {summary['wins']}/{summary['seeds']} = "
+          f"{summary['win_rate'] * 100:.1f}% (95% CI {lo * 100:.1f}-{hi * 100:.1f}%)")
+    t = summary['time']
+    print(f"Time: mean {t['mean']:.1f}s  p50 {t['p50']:.1f}s  p90 {t['p90']:.1f}s  "
+          f"p99 {t['p99']:.1f}s  max {t['max']:.1f}s")
+    print(f"Nodes/sec per worker: {summary['nodes_per_sec']}")
+
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump(summary, f, indent=2)
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f:
+            w = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction='ignore')
+            w.writeheader()
+            w.writerows(results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
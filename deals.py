@@ -0,0 +1,65 @@
+"""Bulk deal generation and deal files, on the 52-byte deal encoding.
+
+A deal is the shuffled deck as 52 card codes (main.deal_bytes); bytes
+objects hash, compare and pickle cheaply, so they serve as dictionary
+keys, for deduplication and as solve_many() inputs. from_deal() on either
+state backend turns one back into a position.
+
+    deals = seed_deals(range(1_000_000))     # same deals as deal_thoughtful
+    write_deals('deals.bin', deals)
+    state = CompactSolitaireState.from_deal(read_deals('deals.bin')[42])
+
+numpy_deals() draws many deals at once from a NumPy Generator. Those are
+uniform random deals in the same layout, but not deal_thoughtful's seeds.
+"""
+import random
+from typing import Iterable, List, Optional
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+from main import DECK_CODES, deal_bytes
+
+
+def seed_deals(seeds: Iterable[int]) -> List[bytes]:
+    """deal_bytes(seed) for every seed: deal_thoughtful's deals."""
+    return [deal_bytes(seed) for seed in seeds]
+
+
+def random_deals(count: int, rng: random.Random) -> List[bytes]:
+    """`count` deals drawn one after another from `rng`."""
+    deck = list(DECK_CODES)
+    out = []
+    for _ in range(count):
+        rng.shuffle(deck)
+        out.append(bytes(deck))
+    return out
+
+
+def numpy_deals(count: int, gen: Optional['np.random.Generator'] = None
+                ) -> 'np.ndarray':
+    """A count x 52 uint8 array of uniform random deals, one per row
+    (row.tobytes() is the deal)."""
+    if np is None:
+        raise ImportError('numpy_deals needs NumPy')
+    if gen is None:
+        gen = np.random.default_rng()
+    decks = np.tile(np.frombuffer(DECK_CODES, dtype=np.uint8), (count, 1))
+    return gen.permuted(decks, axis=1)
+
+
+def write_deals(path: str, deals: Iterable[bytes]):
+    """Write deals back to back, 52 bytes each."""
+    with open(path, 'wb') as f:
+        for deal in deals:
+            f.write(deal)
+
+
+def read_deals(path: str) -> List[bytes]:
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) % 52:
+        raise ValueError(f'{path}: size is not a multiple of 52')
+    return [data[i:i + 52] for i in range(0, len(data), 52)]
@@ -1,8 +1,11 @@
 import random
 import time
-from dataclasses import dataclass, field, replace
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from enum import Enum
-from typing import List, Optional, Tuple, Set, Dict
+from itertools import chain
+from typing import (Callable, Dict, Iterable, Iterator, List, Optional,
+                    Sequence, Set, Tuple, Union)
 
 # ==========================================
 # Constants
@@ -32,18 +35,23 @@ class Suit(Enum):
     def symbol(self):
         return {0: '♥', 1: '♦', 2: '♣', 3: '♠'}[self.value]
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Card:
+    """A card; the 104 (identity, face) combinations are interned in
+    CARD_BY_CODE, which the solver uses instead of constructing Cards."""
     rank: int  # 1(A) ~ 13(K)
     suit: Suit
     face_up: bool = False
     # Cached values to avoid slow Enum property access
     _sv: int = field(init=False, repr=False, compare=False, hash=False)
     _red: bool = field(init=False, repr=False, compare=False, hash=False)
+    _code: int = field(init=False, repr=False, compare=False, hash=False)
 
     def __post_init__(self):
         object.__setattr__(self, '_sv', self.suit.value)
         object.__setattr__(self, '_red', self.suit.value < 2)
+        object.__setattr__(self, '_code', self.rank * 4 + self.suit.value
+                           + (FACE_UP_BIT if self.face_up else 0))
 
     def __repr__(self):
         r_map = {1: 'A', 11: 'J', 12: 'Q', 13: 'K'}
@@ -54,6 +62,61 @@ class Card:
     def can_stack_on_tableau(self, other: 'Card') -> bool:
         return other.face_up and self.rank == other.rank - 1 and self._red != other._red
 
+    @property
+    def code(self) -> int:
+        """Small-int encoding: rank * 4 + suit, plus FACE_UP_BIT if face up."""
+        return self._code
+
+    def __reduce__(self):
+        # Unpickle to the shared instance (states cross process boundaries)
+        return _card_by_code, (self._code,)
+
+# Card codes fit in a byte: rank * 4 + suit is at most 55, so bit 6 is free
+# for the face-up flag. Code 0 never denotes a card and marks empty slots.
+FACE_UP_BIT = 0x40
+CODE_MASK = 0x3F
+
+# Shared Card objects for every code, used to decode compact states and
+# to build Move objects without allocating a Card per move.
+CARD_BY_CODE: List[Optional[Card]] = [None] * 128
+for _sv in range(4):
+    for _rank in range(1, 14):
+        CARD_BY_CODE[_rank * 4 + _sv] = Card(_rank, Suit(_sv), False)
+        CARD_BY_CODE[_rank * 4 + _sv | FACE_UP_BIT] = Card(_rank, Suit(_sv), True)
+del _sv, _rank
+
+def _card_by_code(code: int) -> Card:
+    return CARD_BY_CODE[code]
+
+# Deepest possible tableau column: 6 face-down cards under a full K..A run.
+_COL_CAP = 20
+
+# Zobrist keys. A position hashes to the XOR of one key per card placement:
+#   - tableau: (card code incl. face-up bit, column, depth)
+#   - foundation: card identity (a pile's contents follow from its height)
+#   - talon: stock and waste read as one sequence T = waste + reversed(stock).
+#     Drawing and recycling never reorder T, they only move the waste top,
+#     so T is hashed by its adjacent pairs plus a key for the waste top card.
+# Keys come from a private fixed-seed RNG: hashes are stable across processes
+# and building them does not disturb the global random state.
+_Z_START = 1  # talon sequence sentinels (no card has code 1 or 2)
+_Z_END = 2
+_zrng = random.Random(0x5EED_C0DE)
+_Z_TAB = [_zrng.getrandbits(64) for _ in range(128 * 7 * _COL_CAP)]
+_Z_FOUND = [_zrng.getrandbits(64) for _ in range(64)]
+_Z_PAIR = [_zrng.getrandbits(64) for _ in range(64 * 64)]
+_Z_WTOP = [0] + [_zrng.getrandbits(64) for _ in range(63)]
+del _zrng
+
+def _talon_hash(talon: List[int], waste_top: int) -> int:
+    """Zobrist hash of the talon sequence (card codes, waste bottom first)."""
+    h = _Z_WTOP[waste_top]
+    prev = _Z_START
+    for c in talon:
+        h ^= _Z_PAIR[prev * 64 + c]
+        prev = c
+    return h ^ _Z_PAIR[prev * 64 + _Z_END]
+
 class ActionType(Enum):
     TABLEAU_TO_FOUNDATION = 1
     TABLEAU_TO_TABLEAU = 2
@@ -61,7 +124,7 @@ class ActionType(Enum):
     WASTE_TO_TABLEAU = 4
     FOUNDATION_TO_TABLEAU = 5
 
-@dataclass
+@dataclass(slots=True)
 class Move:
     action_type: ActionType
     src_idx: int
@@ -84,130 +147,388 @@ class Move:
         info = f" (Turns:{self.stock_turns})" if self.stock_turns > 0 else ""
         return f"{self.card} {src}->{dest}{info}"
 
+    def pack(self) -> int:
+        """This move as a packed int; see pack_move()."""
+        return pack_move(self.action_type._value_, self.src_idx, self.dest_idx,
+                         self.card._code, self.num_cards, self.stock_turns)
+
+    @staticmethod
+    def unpack(packed: int) -> 'Move':
+        """Inverse of pack(). The priority is not stored and reads as 6."""
+        return Move(ActionType(packed >> 17 & 7), (packed >> 14 & 7) - 1,
+                    packed >> 11 & 7, CARD_BY_CODE[packed >> 4 & 0x7F],
+                    packed & 0xF, packed >> 20)
+
+# Packed moves fit in 26 bits, so a solution is an array of uint32:
+#   bits 0-3 num_cards, 4-10 card code (incl. FACE_UP_BIT), 11-13 dest,
+#   14-16 src + 1 (the stock is -1), 17-19 action type, 20-25 stock turns.
+# A move's signature is its packed form without stock turns or face-up bit,
+# which is what reverse-move filtering compares.
+_SIG_MASK = (1 << 20) - 1 & ~(FACE_UP_BIT << 4)
+
+
+def pack_move(action: int, src: int, dest: int, code: int,
+              num_cards: int = 1, stock_turns: int = 0) -> int:
+    return (stock_turns << 20 | action << 17 | (src + 1) << 14 | dest << 11
+            | code << 4 | num_cards)
+
+# Suit symmetries. The rules and both heuristics are unchanged by swapping
+# hearts with diamonds and/or clubs with spades, so positions that differ
+# only by such a swap are equivalent. SUIT_SYMMETRIES[k][sv] is the suit sv
+# becomes under symmetry k; every symmetry is its own inverse.
+SUIT_SYMMETRIES = ((0, 1, 2, 3), (1, 0, 2, 3), (0, 1, 3, 2), (1, 0, 3, 2))
+# Card codes (face-up bit kept, 0 = no card) under each symmetry, as
+# 256-byte bytes.translate() tables
+_SYM_CODE = [bytes(c & ~3 | perm[c & 3] if 4 <= c & CODE_MASK < 56 else c
+                   for c in range(256)) for perm in SUIT_SYMMETRIES]
+
+def _symmetric_hashes(columns: Sequence[Sequence[int]], heights: Sequence[int],
+                      talon: Sequence[int], waste_len: int) -> List[int]:
+    """state_hash() of a position under each suit symmetry, from its column
+    codes, foundation heights and talon (waste bottom first)."""
+    hashes = []
+    for perm, table in zip(SUIT_SYMMETRIES, _SYM_CODE):
+        h = 0
+        for ci, col in enumerate(columns):
+            for pos, c in enumerate(col):
+                h ^= _Z_TAB[(table[c] * 7 + ci) * _COL_CAP + pos]
+        for sv, k in enumerate(heights):
+            for rank in range(1, k + 1):
+                h ^= _Z_FOUND[rank * 4 + perm[sv]]
+        t = [table[c] for c in talon]
+        hashes.append(h ^ _talon_hash(t, t[waste_len - 1] if waste_len else 0))
+    return hashes
+
+def permute_move(move: Move, k: int) -> Move:
+    """`move` as played in the position mapped by suit symmetry k."""
+    perm = SUIT_SYMMETRIES[k]
+    at = move.action_type
+    src, dest = move.src_idx, move.dest_idx
+    if at == ActionType.FOUNDATION_TO_TABLEAU:
+        src = perm[src]
+    elif at in (ActionType.TABLEAU_TO_FOUNDATION, ActionType.WASTE_TO_FOUNDATION):
+        dest = perm[dest]
+    return Move(at, src, dest, CARD_BY_CODE[_SYM_CODE[k][move.card._code]],
+                move.num_cards, move.stock_turns, move.priority)
+
 # ==========================================
 # 2. Game State with K+ Logic
 # ==========================================
 
+class TalonCycle:
+    """K+ talon reachability table shared by move generation and H2.
+
+    Read the talon as one sequence T = waste + reversed(stock). Drawing
+    three moves the waste/stock boundary p = len(waste) forward and a
+    recycle resets it to 0; neither reorders T. The turns at which each
+    waste top becomes reachable therefore depend only on (len(T), p), and
+    the card on top after a turn is T[p - 1]. Sequences are computed once
+    per (len(T), p) and shared by every state; removing the waste top just
+    selects the (len(T) - 1, p - 1) entry."""
+
+    MAX_TURNS = 60
+    _steps: Dict[Tuple[int, int], Tuple[Tuple[int, int], ...]] = {}
+
+    @staticmethod
+    def steps(talon_len: int, waste_len: int) -> Tuple[Tuple[int, int], ...]:
+        """(stock_turns, p) for every distinct waste top reachable in order."""
+        key = (talon_len, waste_len)
+        steps = TalonCycle._steps.get(key)
+        if steps is None:
+            out = []
+            seen = set()
+            p = waste_len
+            for turns in range(TalonCycle.MAX_TURNS):
+                if p in seen:
+                    break
+                seen.add(p)
+                if p:
+                    out.append((turns, p))
+                if p == talon_len:
+                    if not talon_len:
+                        break
+                    p = 0
+                p = min(p + 3, talon_len)
+            steps = TalonCycle._steps[key] = tuple(out)
+        return steps
+
+    @staticmethod
+    def advance(talon_len: int, waste_len: int, turns: int) -> int:
+        """Waste length after drawing `turns` times (recycling when empty)."""
+        p = waste_len
+        for _ in range(turns):
+            if p == talon_len:
+                p = 0
+            p = min(p + 3, talon_len)
+        return p
+
+# Build targets of each card code in the relaxed check: the two cards of
+# the other colour one rank higher (none for Kings, which need an empty column).
+_BUILD_TARGETS = [()] * 56
+for _c in range(4, 52):
+    _up = (_c >> 2) * 4 + 4
+    _BUILD_TARGETS[_c] = (_up + 2, _up + 3) if (_c & 3) < 2 else (_up, _up + 1)
+del _c, _up
+
+def _relaxed_solvable(columns: Sequence[Sequence[int]],
+                      heights: Sequence[int]) -> bool:
+    """Paper Sec 4.1: solvability with delete effects removed.
+
+    columns holds tableau card codes (bottom first), heights the foundation
+    height per suit; every other card is in the talon and, relaxed, always
+    available. A card that has been exposed stays a build target, and a
+    card that has moved (to a foundation or onto a target) never covers
+    the cards under it again. Each real move is still possible in the
+    relaxed game, so False proves the position lost."""
+    found = [False] * 56
+    for sv in range(4):
+        for rank in range(1, heights[sv] + 1):
+            found[rank * 4 + sv] = True
+    free = [True] * 56      # may be picked up (face up, talon or foundation)
+    exposed = [False] * 56  # has been the top card of a tableau pile
+    moved = [False] * 56
+    where: Dict[int, Tuple[int, int]] = {}
+    low = []                # per column: cards at index >= low have all moved
+    empty = False
+    for ci, col in enumerate(columns):
+        low.append(len(col))
+        if col:
+            exposed[col[-1] & CODE_MASK] = True
+        else:
+            empty = True
+        for pos, c in enumerate(col):
+            where[c & CODE_MASK] = (ci, pos)
+            if not c & FACE_UP_BIT:
+                free[c & CODE_MASK] = False
+
+    progress = True
+    while progress:
+        progress = False
+        for c in range(4, 56):
+            if not free[c]:
+                continue
+            go = False
+            if not found[c] and (c < 8 or found[c - 4]):
+                found[c] = go = True
+            targets = _BUILD_TARGETS[c]
+            if (empty if c >= 52 else exposed[targets[0]] or exposed[targets[1]]) \
+                    and (not exposed[c] or (c in where and not moved[c])):
+                exposed[c] = go = True
+            if not go:
+                continue
+            progress = True
+            if c in where and not moved[c]:
+                moved[c] = True
+                ci, pos = where[c]
+                col = columns[ci]
+                k = low[ci]
+                while k and moved[col[k - 1] & CODE_MASK]:
+                    k -= 1
+                low[ci] = k
+                if k:
+                    below = col[k - 1] & CODE_MASK
+                    free[below] = exposed[below] = True
+                else:
+                    empty = True
+    return all(found[4:56])
+
+def _iter_buckets(moves: List[Move], add_talon: Callable[[List[Move]], None],
+                  rng) -> Iterator[Move]:
+    """Yield `moves` by priority, 1 to 6, shuffling each bucket with rng.
+
+    Talon moves have priority 2 or 4; add_talon() appends them to a list
+    and is only called once bucket 1 has been used up."""
+    buckets: List[List[Move]] = [[] for _ in range(7)]
+    for m in moves:
+        buckets[m.priority].append(m)
+    for pri in range(1, 7):
+        if pri == 2:
+            talon: List[Move] = []
+            add_talon(talon)
+            for m in talon:
+                buckets[m.priority].append(m)
+        bucket = buckets[pri]
+        if len(bucket) > 1:
+            rng.shuffle(bucket)
+        yield from bucket
+
+# Deals. deal_thoughtful() shuffles this deck (card codes, suit by suit)
+# and deals the tableau from its end: column i, depth j is deck[51 - k]
+# for the k-th (i, j) of _DEAL_ORDER. The first 24 cards are the stock.
+# The shuffled deck itself, as 52 bytes, is a deal's canonical encoding.
+DECK_CODES = bytes(rank * 4 + sv for sv in range(4) for rank in range(1, 14))
+_SORTED_DECK = sorted(DECK_CODES)
+_DEAL_ORDER = [(i, j) for i in range(7) for j in range(i + 1)]
+
+def deal_bytes(seed=None) -> bytes:
+    """The 52-byte encoding of the deal_thoughtful(seed) deal. `seed` may
+    also be a random.Random, which is advanced; None uses the global
+    random module, as deal_thoughtful() does."""
+    if isinstance(seed, random.Random):
+        rng = seed
+    else:
+        rng = random if seed is None else random.Random(seed)
+    deck = list(DECK_CODES)
+    rng.shuffle(deck)
+    return bytes(deck)
+
+def _check_deal(deal: bytes):
+    if len(deal) != 52 or sorted(deal) != _SORTED_DECK:
+        raise ValueError('a deal is a permutation of DECK_CODES')
+
+def encode_deal(state) -> bytes:
+    """Inverse of from_deal() for a state that is still a fresh deal."""
+    if state.waste or any(state.foundation_heights()) or len(state.stock) != 24:
+        raise ValueError('not a fresh deal')
+    deck = bytearray(52)
+    deck[:24] = bytes(c.code for c in state.stock)
+    for k, (i, j) in enumerate(_DEAL_ORDER):
+        deck[51 - k] = state.tableau[i][j].code & CODE_MASK
+    _check_deal(deck)
+    return bytes(deck)
+
 class SolitaireState:
+    # Debug mode: verify the incremental hash against a full recompute
+    # on every state_hash() call.
+    check_hash = False
+
     def __init__(self):
         self.tableau: List[List[Card]] = [[] for _ in range(7)]
         self.foundation: List[List[Card]] = [[] for _ in range(4)]
         self.stock: List[Card] = []
         self.waste: List[Card] = []
+        self.rehash()
 
     def clone(self):
-        s = SolitaireState.__new__(SolitaireState)
+        cls = type(self)  # keeps the profiling subclass (see SearchStats)
+        s = cls.__new__(cls)
         s.tableau = [list(col) for col in self.tableau]
         s.foundation = [list(f) for f in self.foundation]
         s.stock = list(self.stock)
         s.waste = list(self.waste)
+        s._zh = self._zh
+        s._col_terms = list(self._col_terms)
+        s._fd = self._fd
         return s
 
     def deal_thoughtful(self, seed=None):
-        if seed is not None:
-            random.seed(seed)
-        deck = [Card(rank, suit) for suit in Suit for rank in range(1, 14)]
-        random.shuffle(deck)
-        for i in range(7):
-            for j in range(i + 1):
-                card = deck.pop()
-                card = replace(card, face_up=(j == i))
-                self.tableau[i].append(card)
-        self.stock = deck
+        # A private Random(seed) deals exactly what random.seed(seed) did,
+        # without resetting the global generator.
+        self._set_deal(deal_bytes(seed))
+
+    @classmethod
+    def from_deal(cls, deal: bytes) -> 'SolitaireState':
+        """A fresh deal from its 52-byte encoding (see deal_bytes())."""
+        _check_deal(deal)
+        s = cls.__new__(cls)
+        s._set_deal(deal)
+        return s
+
+    def _set_deal(self, deal: bytes):
+        tableau = [[] for _ in range(7)]
+        for k, (i, j) in enumerate(_DEAL_ORDER):
+            up = FACE_UP_BIT if j == i else 0
+            tableau[i].append(CARD_BY_CODE[deal[51 - k] | up])
+        self.tableau = tableau
+        self.foundation = [[] for _ in range(4)]
+        self.stock = [CARD_BY_CODE[c] for c in deal[:24]]
         self.waste = []
+        self.rehash()
 
     def is_win(self):
         f = self.foundation
         return len(f[0]) + len(f[1]) + len(f[2]) + len(f[3]) == 52
 
     def state_hash(self):
-        parts = []
+        """64-bit Zobrist hash, kept up to date by apply_move()."""
+        if self.check_hash:
+            assert self._zh == self._compute_hash(), "stale incremental hash"
+        return self._zh
+
+    def rehash(self):
+        """Recompute the hash and evaluation terms after editing the piles
+        directly."""
+        self._zh = self._compute_hash()
+        # Evaluator.evaluate_incremental() terms: per-column Features 2/5/6
+        # (None = rescore on next use) and a bitmask of face-down card codes.
+        self._col_terms: List[Optional[Tuple[int, int]]] = [None] * 7
+        self._fd = 0
         for col in self.tableau:
             for c in col:
-                parts.append(c.rank * 8 + c._sv * 2 + c.face_up)
-            parts.append(-1)
+                if not c.face_up:
+                    self._fd |= 1 << c._code
+
+    def column_terms(self) -> List[Tuple[int, int]]:
+        """(H1, H2) Feature 2/5/6 terms per column; rescores only columns
+        whose face-down part or first face-up card changed."""
+        terms = self._col_terms
+        for ci in range(7):
+            if terms[ci] is None:
+                terms[ci] = Evaluator.column_terms(
+                    [c._code for c in self.tableau[ci]])
+        return terms
+
+    def foundation_heights(self) -> List[int]:
+        return [len(f) for f in self.foundation]
+
+    def _compute_hash(self) -> int:
+        h = 0
+        for ci, col in enumerate(self.tableau):
+            for pos, c in enumerate(col):
+                h ^= _Z_TAB[(c._code * 7 + ci) * _COL_CAP + pos]
         for pile in self.foundation:
-            parts.append(len(pile))
-        parts.append(-2)
-        for c in self.stock:
-            parts.append(c.rank * 4 + c._sv)
-        parts.append(-3)
-        for c in self.waste:
-            parts.append(c.rank * 4 + c._sv)
-        return hash(tuple(parts))
+            for c in pile:
+                h ^= _Z_FOUND[c._code & CODE_MASK]
+        talon = [c._code for c in self.waste]
+        talon.extend(c._code for c in reversed(self.stock))
+        return h ^ _talon_hash(talon, talon[len(self.waste) - 1] if self.waste else 0)
+
+    def canonical_hash(self) -> Tuple[int, int]:
+        """(hash, k): the smallest state_hash() among the suit-symmetric
+        images of this position, and the symmetry k producing it.
+        Equivalent positions share the hash; permute_move(m, k) maps moves
+        between this position and the canonical one, both ways."""
+        talon = [c._code for c in self.waste]
+        talon.extend(c._code for c in reversed(self.stock))
+        hashes = _symmetric_hashes(
+            [[c._code for c in col] for col in self.tableau],
+            self.foundation_heights(), talon, len(self.waste))
+        h = min(hashes)
+        return h, hashes.index(h)
+
+    def permute_suits(self, k: int) -> 'SolitaireState':
+        """A copy mapped by suit symmetry k."""
+        perm, table = SUIT_SYMMETRIES[k], _SYM_CODE[k]
+        s = self.clone()
+        s.tableau = [[CARD_BY_CODE[table[c._code]] for c in col]
+                     for col in self.tableau]
+        for sv, pile in enumerate(self.foundation):
+            s.foundation[perm[sv]] = [CARD_BY_CODE[table[c._code]] for c in pile]
+        s.stock = [CARD_BY_CODE[table[c._code]] for c in self.stock]
+        s.waste = [CARD_BY_CODE[table[c._code]] for c in self.waste]
+        s.rehash()
+        return s
 
     def get_reachable_talon_cards(self) -> Set[Tuple[int, int]]:
         reachable = set()
-        sim_stock = list(self.stock)
-        sim_waste = list(self.waste)
-        seen = set()
-        for _ in range(60):
-            if sim_waste:
-                c = sim_waste[-1]
-                reachable.add((c.rank, c._sv))
-            key = (tuple(c.rank * 10 + c._sv for c in sim_stock),
-                   tuple(c.rank * 10 + c._sv for c in sim_waste))
-            if key in seen:
-                break
-            seen.add(key)
-            if not sim_stock:
-                if not sim_waste:
-                    break
-                sim_stock = list(reversed(sim_waste))
-                sim_waste = []
-            draw = min(3, len(sim_stock))
-            for _ in range(draw):
-                sim_waste.append(sim_stock.pop())
+        for _, c in self._talon_tops():
+            reachable.add((c.rank, c._sv))
         return reachable
 
+    def _talon_tops(self):
+        """(stock_turns, card) for each reachable waste top, via TalonCycle."""
+        waste, stock = self.waste, self.stock
+        wl = len(waste)
+        n = wl + len(stock)
+        return [(turns, waste[p - 1] if p <= wl else stock[n - p])
+                for turns, p in TalonCycle.steps(n, wl)]
+
     def is_relaxed_solvable(self) -> bool:
         """Paper Sec 4.1: Relaxed domain pruning.
         Check if the game can be solved when delete effects are removed.
         If not, the real game is also unsolvable."""
-        next_rank = [len(f) + 1 for f in self.foundation]
-
-        # Map each card identity to its tableau position
-        card_col_pos: Dict[Tuple[int, int], Tuple[int, int]] = {}
-        for i, col in enumerate(self.tableau):
-            for j, card in enumerate(col):
-                card_col_pos[(card.rank, card._sv)] = (i, j)
-
-        # Track frontier per column: deepest accessible position
-        frontier: Dict[int, int] = {}
-        accessible: Set[Tuple[int, int]] = set()
-        for i, col in enumerate(self.tableau):
-            for j in range(len(col)):
-                if col[j].face_up:
-                    frontier[i] = j
-                    for k in range(j, len(col)):
-                        accessible.add((col[k].rank, col[k]._sv))
-                    break
-
-        # In relaxed domain, ALL stock/waste cards are accessible
-        # (delete effects removed → stock never consumed → all cards reachable)
-        for c in self.stock:
-            accessible.add((c.rank, c._sv))
-        for c in self.waste:
-            accessible.add((c.rank, c._sv))
-
-        progress = True
-        while progress:
-            progress = False
-            for sv in range(4):
-                r = next_rank[sv]
-                while r <= 13 and (r, sv) in accessible:
-                    next_rank[sv] = r + 1
-                    progress = True
-                    # Reveal card below in tableau
-                    if (r, sv) in card_col_pos:
-                        ci, pos = card_col_pos[(r, sv)]
-                        if ci in frontier and pos == frontier[ci] and pos > 0:
-                            frontier[ci] = pos - 1
-                            below = self.tableau[ci][pos - 1]
-                            accessible.add((below.rank, below._sv))
-                    r = next_rank[sv]
-
-        return all(n > 13 for n in next_rank)
+        return _relaxed_solvable([[c._code for c in col] for col in self.tableau],
+                                 [len(f) for f in self.foundation])
 
     def can_foundation_return(self, card_rank: int) -> bool:
         """Paper Sec 4.4: Foundation card can return unless rank<=2
@@ -225,9 +546,30 @@ class SolitaireState:
     # Priority: 1=T→F(reveal), 2=any→F, 3=T→T(reveal),
     #           4=Waste→T, 5=F→T, 6=T→T(no reveal)
     # ----------------------------------------------------------------
-    def get_ordered_moves(self) -> List[Move]:
-        all_moves: List[Move] = []
+    def get_ordered_moves(self, rng=random) -> List[Move]:
+        """Legal moves sorted by priority; ties are shuffled with rng."""
         first_empty_for_king = self._first_empty_col()
+        all_moves = self._tableau_moves(first_empty_for_king)
+        self._talon_moves(all_moves, first_empty_for_king)
+        rng.shuffle(all_moves)
+        all_moves.sort(key=lambda m: m.priority)
+        return all_moves
+
+    def iter_ordered_moves(self, rng=random) -> Iterator[Move]:
+        """Lazy get_ordered_moves(): the same moves, one priority bucket at
+        a time, each bucket shuffled with rng. The K+ talon scan runs only
+        when the consumer gets past bucket 1. The order (and the use of rng)
+        differs from get_ordered_moves(), which shuffles all moves at once.
+        The state must be unchanged whenever the iterator is resumed."""
+        first_empty_for_king = self._first_empty_col()
+        return _iter_buckets(self._tableau_moves(first_empty_for_king),
+                             lambda moves: self._talon_moves(
+                                 moves, first_empty_for_king), rng)
+
+    def _tableau_moves(self, first_empty_for_king) -> List[Move]:
+        """Tableau → foundation, tableau → tableau and foundation →
+        tableau moves, unordered."""
+        all_moves: List[Move] = []
 
         # --- Tableau moves ---
         for i, col in enumerate(self.tableau):
@@ -299,35 +641,14 @@ class SolitaireState:
                         all_moves.append(Move(
                             ActionType.FOUNDATION_TO_TABLEAU, f_idx, ti,
                             top, priority=5))
+        return all_moves
 
-        # --- K+ Waste/Stock moves ---
-        sim_stock = list(self.stock)
-        sim_waste = list(self.waste)
-        seen_states: Set = set()
+    def _talon_moves(self, moves: List[Move], first_empty_for_king):
+        """Append the K+ waste/stock moves to `moves`."""
         found: Set = set()
-        first_empty_for_king = self._first_empty_col()
-
-        for turns in range(60):
-            if sim_waste:
-                self._gen_waste_moves(
-                    sim_waste[-1], turns, all_moves, found, first_empty_for_king)
-            key = (tuple(c.rank * 10 + c._sv for c in sim_stock),
-                   tuple(c.rank * 10 + c._sv for c in sim_waste))
-            if key in seen_states:
-                break
-            seen_states.add(key)
-            if not sim_stock:
-                if not sim_waste:
-                    break
-                sim_stock = list(reversed(sim_waste))
-                sim_waste = []
-            draw = min(3, len(sim_stock))
-            for _ in range(draw):
-                sim_waste.append(sim_stock.pop())
-
-        random.shuffle(all_moves)
-        all_moves.sort(key=lambda m: m.priority)
-        return all_moves
+        for turns, card in self._talon_tops():
+            self._gen_waste_moves(
+                card, turns, moves, found, first_empty_for_king)
 
     def _first_empty_col(self) -> Optional[int]:
         for i in range(7):
@@ -335,6 +656,12 @@ class SolitaireState:
                 return i
         return None
 
+    def uncovers_face_down(self, col_idx: int, num_cards: int) -> bool:
+        """True if taking num_cards off column col_idx exposes a face-down card."""
+        col = self.tableau[col_idx]
+        remaining = len(col) - num_cards
+        return remaining > 0 and not col[remaining - 1].face_up
+
     def _gen_waste_moves(self, card, turns, moves, found, first_empty):
         # Waste → Foundation
         c_rank = card.rank
@@ -368,46 +695,144 @@ class SolitaireState:
                                           card, stock_turns=turns, priority=4))
                         found.add(aid)
 
-    def apply_move(self, move: Move):
-        # K+ macro: cycle stock
+    def apply_move(self, move: Move) -> tuple:
+        """Apply move in place. Returns an undo record for undo_move()."""
+        undo_zh = self._zh
+        talon_split = -1
+        flipped = False
+        # K+ macro: cycle stock (only the waste top changes in the hash)
         if move.stock_turns > 0:
-            for _ in range(move.stock_turns):
-                if not self.stock:
-                    self.stock = list(reversed(self.waste))
-                    self.waste = []
-                draw = min(3, len(self.stock))
-                for _ in range(draw):
-                    self.waste.append(self.stock.pop())
+            talon_split = len(self.waste)
+            n = talon_split + len(self.stock)
+            p = TalonCycle.advance(n, talon_split, move.stock_turns)
+            if p != talon_split:
+                talon = self.waste + self.stock[::-1]
+                self._zh ^= _Z_WTOP[talon[talon_split - 1]._code if talon_split else 0] \
+                    ^ _Z_WTOP[talon[p - 1]._code if p else 0]
+                self.waste = talon[:p]
+                self.stock = talon[p:][::-1]
 
         at = move.action_type
         if at == ActionType.TABLEAU_TO_FOUNDATION:
-            c = self.tableau[move.src_idx].pop()
-            self.foundation[move.dest_idx].append(
-                Card(c.rank, c.suit, True))
-            self._flip_top(move.src_idx)
+            col = self.tableau[move.src_idx]
+            c = col.pop()
+            self._zh ^= _Z_TAB[(c._code * 7 + move.src_idx) * _COL_CAP + len(col)] \
+                ^ _Z_FOUND[c._code & CODE_MASK]
+            self.foundation[move.dest_idx].append(CARD_BY_CODE[c._code | FACE_UP_BIT])
+            flipped = self._flip_top(move.src_idx)
+            if flipped or not col:
+                self._col_terms[move.src_idx] = None
         elif at == ActionType.TABLEAU_TO_TABLEAU:
-            stack = self.tableau[move.src_idx][-move.num_cards:]
-            del self.tableau[move.src_idx][-move.num_cards:]
-            self.tableau[move.dest_idx].extend(stack)
-            self._flip_top(move.src_idx)
+            src, dest = move.src_idx, move.dest_idx
+            src_col = self.tableau[src]
+            dest_col = self.tableau[dest]
+            s0 = len(src_col) - move.num_cards
+            shift = len(dest_col) - s0
+            zh = self._zh
+            for k in range(s0, len(src_col)):
+                code7 = src_col[k]._code * 7
+                zh ^= _Z_TAB[(code7 + src) * _COL_CAP + k] \
+                    ^ _Z_TAB[(code7 + dest) * _COL_CAP + k + shift]
+            self._zh = zh
+            if not dest_col:
+                self._col_terms[dest] = None
+            dest_col.extend(src_col[s0:])
+            del src_col[s0:]
+            flipped = self._flip_top(src)
+            if flipped or not src_col:
+                self._col_terms[src] = None
         elif at == ActionType.WASTE_TO_FOUNDATION:
-            c = self.waste.pop()
-            self.foundation[move.dest_idx].append(
-                Card(c.rank, c.suit, True))
+            c = self._pop_waste()
+            self._zh ^= _Z_FOUND[c._code]
+            self.foundation[move.dest_idx].append(CARD_BY_CODE[c._code | FACE_UP_BIT])
         elif at == ActionType.WASTE_TO_TABLEAU:
-            c = self.waste.pop()
-            self.tableau[move.dest_idx].append(
-                Card(c.rank, c.suit, True))
+            c = self._pop_waste()
+            col = self.tableau[move.dest_idx]
+            self._zh ^= _Z_TAB[
+                ((c._code | FACE_UP_BIT) * 7 + move.dest_idx) * _COL_CAP + len(col)]
+            if not col:
+                self._col_terms[move.dest_idx] = None
+            col.append(CARD_BY_CODE[c._code | FACE_UP_BIT])
         elif at == ActionType.FOUNDATION_TO_TABLEAU:
             c = self.foundation[move.src_idx].pop()
-            self.tableau[move.dest_idx].append(
-                Card(c.rank, c.suit, True))
-
-    def _flip_top(self, col_idx):
+            col = self.tableau[move.dest_idx]
+            self._zh ^= _Z_FOUND[c._code & CODE_MASK] \
+                ^ _Z_TAB[(c._code * 7 + move.dest_idx) * _COL_CAP + len(col)]
+            if not col:
+                self._col_terms[move.dest_idx] = None
+            col.append(CARD_BY_CODE[c._code | FACE_UP_BIT])
+        return (undo_zh, flipped, talon_split)
+
+    def undo_move(self, move: Move, undo: tuple):
+        """Exactly revert apply_move(move), given the record it returned."""
+        zh, flipped, talon_split = undo
+        terms = self._col_terms
+        at = move.action_type
+        if at == ActionType.TABLEAU_TO_FOUNDATION:
+            col = self.tableau[move.src_idx]
+            if flipped:
+                col[-1] = CARD_BY_CODE[col[-1]._code & CODE_MASK]
+                self._fd |= 1 << col[-1]._code
+            if flipped or not col:
+                terms[move.src_idx] = None
+            col.append(self.foundation[move.dest_idx].pop())
+        elif at == ActionType.TABLEAU_TO_TABLEAU:
+            src_col = self.tableau[move.src_idx]
+            dest_col = self.tableau[move.dest_idx]
+            if flipped:
+                src_col[-1] = CARD_BY_CODE[src_col[-1]._code & CODE_MASK]
+                self._fd |= 1 << src_col[-1]._code
+            if flipped or not src_col:
+                terms[move.src_idx] = None
+            src_col.extend(dest_col[-move.num_cards:])
+            del dest_col[-move.num_cards:]
+            if not dest_col:
+                terms[move.dest_idx] = None
+        elif at == ActionType.WASTE_TO_FOUNDATION:
+            c = self.foundation[move.dest_idx].pop()
+            self.waste.append(CARD_BY_CODE[c._code & CODE_MASK])
+        elif at == ActionType.WASTE_TO_TABLEAU:
+            col = self.tableau[move.dest_idx]
+            c = col.pop()
+            if not col:
+                terms[move.dest_idx] = None
+            self.waste.append(CARD_BY_CODE[c._code & CODE_MASK])
+        elif at == ActionType.FOUNDATION_TO_TABLEAU:
+            col = self.tableau[move.dest_idx]
+            self.foundation[move.src_idx].append(col.pop())
+            if not col:
+                terms[move.dest_idx] = None
+
+        # Stock cycling keeps waste + reversed(stock) fixed; re-split it
+        if talon_split >= 0:
+            talon = self.waste + self.stock[::-1]
+            self.waste = talon[:talon_split]
+            self.stock = talon[talon_split:][::-1]
+        self._zh = zh
+
+    def _pop_waste(self) -> Card:
+        """Pop the waste top, unlinking it from the talon sequence hash."""
+        waste = self.waste
+        c = waste.pop()
+        code = c._code
+        prev = waste[-1]._code if waste else _Z_START
+        nxt = self.stock[-1]._code if self.stock else _Z_END
+        self._zh ^= _Z_PAIR[prev * 64 + code] ^ _Z_PAIR[code * 64 + nxt] \
+            ^ _Z_PAIR[prev * 64 + nxt] \
+            ^ _Z_WTOP[code] ^ _Z_WTOP[waste[-1]._code if waste else 0]
+        return c
+
+    def _flip_top(self, col_idx) -> bool:
         col = self.tableau[col_idx]
         if col and not col[-1].face_up:
             c = col[-1]
-            col[-1] = Card(c.rank, c.suit, True)
+            col[-1] = CARD_BY_CODE[c._code | FACE_UP_BIT]
+            self._fd ^= 1 << c._code
+            pos = len(col) - 1
+            self._zh ^= _Z_TAB[(c._code * 7 + col_idx) * _COL_CAP + pos] \
+                ^ _Z_TAB[((c._code | FACE_UP_BIT) * 7 + col_idx) * _COL_CAP + pos]
+            return True
+        return False
 
     def display(self):
         print("=" * 55)
@@ -437,18 +862,569 @@ class SolitaireState:
         print("=" * 55)
 
 # ==========================================
-# 3. Heuristic Evaluator (Paper Table 1)
+# 3. Compact Game State (integer-encoded cards)
+# ==========================================
+
+# Buffer layout of CompactSolitaireState.buf. Every pile is a run of card
+# codes (see FACE_UP_BIT) with its length kept in the header; slots past the
+# length are always zero so the raw bytes identify the position.
+_T_LEN = 0                          # 7 bytes: tableau column lengths (b[i])
+_F_LEN = 7                          # 4 bytes: foundation height per suit
+_S_LEN = 11                         # stock length
+_W_LEN = 12                         # waste length
+_T_BASE = 13
+_S_BASE = _T_BASE + 7 * _COL_CAP
+_W_BASE = _S_BASE + 24
+_BUF_SIZE = _W_BASE + 24
+_ZEROS = [bytes(n) for n in range(25)]
+
+
+class CompactSolitaireState:
+    """Drop-in alternative to SolitaireState backed by a single bytearray.
+
+    Cards are stored as codes (rank * 4 + suit, FACE_UP_BIT when face up);
+    foundations only need their heights. clone() is one fixed-size buffer
+    copy and apply_move() never creates Card objects. Moves still carry
+    Card instances, taken from the shared CARD_BY_CODE table.
+    state_hash() uses the same Zobrist keys as SolitaireState, so equal
+    positions hash equally on both backends."""
+
+    check_hash = False
+
+    def __init__(self):
+        self.buf = bytearray(_BUF_SIZE)
+        self.rehash()
+
+    def clone(self):
+        cls = type(self)
+        s = cls.__new__(cls)
+        s.buf = self.buf[:]
+        s._zh = self._zh
+        s._col_terms = list(self._col_terms)
+        s._fd = self._fd
+        return s
+
+    @classmethod
+    def from_state(cls, state: SolitaireState) -> 'CompactSolitaireState':
+        s = cls()
+        b = s.buf
+        for i, col in enumerate(state.tableau):
+            base = _T_BASE + i * _COL_CAP
+            b[base:base + len(col)] = bytes(c.code for c in col)
+            b[_T_LEN + i] = len(col)
+        for i, pile in enumerate(state.foundation):
+            b[_F_LEN + i] = len(pile)
+        b[_S_BASE:_S_BASE + len(state.stock)] = bytes(c.code for c in state.stock)
+        b[_S_LEN] = len(state.stock)
+        b[_W_BASE:_W_BASE + len(state.waste)] = bytes(c.code for c in state.waste)
+        b[_W_LEN] = len(state.waste)
+        s.rehash()
+        return s
+
+    def to_state(self) -> SolitaireState:
+        s = SolitaireState()
+        s.tableau = self.tableau
+        s.foundation = self.foundation
+        s.stock = self.stock
+        s.waste = self.waste
+        s._zh = self._zh
+        s._col_terms = list(self._col_terms)
+        s._fd = self._fd
+        return s
+
+    def deal_thoughtful(self, seed=None):
+        self._set_deal(deal_bytes(seed))
+
+    @classmethod
+    def from_deal(cls, deal: bytes) -> 'CompactSolitaireState':
+        _check_deal(deal)
+        s = cls.__new__(cls)
+        s._set_deal(deal)
+        return s
+
+    def _set_deal(self, deal: bytes):
+        b = bytearray(_BUF_SIZE)
+        for k, (i, j) in enumerate(_DEAL_ORDER):
+            up = FACE_UP_BIT if j == i else 0
+            b[_T_BASE + i * _COL_CAP + j] = deal[51 - k] | up
+        b[_T_LEN:_T_LEN + 7] = range(1, 8)
+        b[_S_BASE:_S_BASE + 24] = deal[:24]
+        b[_S_LEN] = 24
+        self.buf = b
+        self.rehash()
+
+    # --- Card-list views, for display and code written against SolitaireState ---
+
+    @property
+    def tableau(self) -> List[List[Card]]:
+        b = self.buf
+        return [[CARD_BY_CODE[c] for c in
+                 b[_T_BASE + i * _COL_CAP:_T_BASE + i * _COL_CAP + b[_T_LEN + i]]]
+                for i in range(7)]
+
+    @property
+    def foundation(self) -> List[List[Card]]:
+        b = self.buf
+        return [[CARD_BY_CODE[r * 4 + sv | FACE_UP_BIT]
+                 for r in range(1, b[_F_LEN + sv] + 1)] for sv in range(4)]
+
+    @property
+    def stock(self) -> List[Card]:
+        b = self.buf
+        return [CARD_BY_CODE[c] for c in b[_S_BASE:_S_BASE + b[_S_LEN]]]
+
+    @property
+    def waste(self) -> List[Card]:
+        b = self.buf
+        return [CARD_BY_CODE[c] for c in b[_W_BASE:_W_BASE + b[_W_LEN]]]
+
+    def is_win(self):
+        b = self.buf
+        return b[_F_LEN] + b[_F_LEN + 1] + b[_F_LEN + 2] + b[_F_LEN + 3] == 52
+
+    def state_hash(self):
+        if self.check_hash:
+            assert self._zh == self._compute_hash(), "stale incremental hash"
+        return self._zh
+
+    def rehash(self):
+        self._zh = self._compute_hash()
+        self._col_terms: List[Optional[Tuple[int, int]]] = [None] * 7
+        self._fd = 0
+        b = self.buf
+        for ci in range(7):
+            base = _T_BASE + ci * _COL_CAP
+            for c in b[base:base + b[ci]]:
+                if not c & FACE_UP_BIT:
+                    self._fd |= 1 << c
+
+    def column_terms(self) -> List[Tuple[int, int]]:
+        terms = self._col_terms
+        b = self.buf
+        for ci in range(7):
+            if terms[ci] is None:
+                base = _T_BASE + ci * _COL_CAP
+                terms[ci] = Evaluator.column_terms(b[base:base + b[ci]])
+        return terms
+
+    def foundation_heights(self) -> List[int]:
+        return list(self.buf[_F_LEN:_F_LEN + 4])
+
+    def _compute_hash(self) -> int:
+        b = self.buf
+        h = 0
+        for ci in range(7):
+            base = _T_BASE + ci * _COL_CAP
+            for pos in range(b[ci]):
+                h ^= _Z_TAB[(b[base + pos] * 7 + ci) * _COL_CAP + pos]
+        for sv in range(4):
+            for rank in range(1, b[_F_LEN + sv] + 1):
+                h ^= _Z_FOUND[rank * 4 + sv]
+        wl = b[_W_LEN]
+        talon = list(b[_W_BASE:_W_BASE + wl])
+        talon.extend(b[_S_BASE:_S_BASE + b[_S_LEN]][::-1])
+        return h ^ _talon_hash(talon, talon[wl - 1] if wl else 0)
+
+    def canonical_hash(self) -> Tuple[int, int]:
+        b = self.buf
+        wl = b[_W_LEN]
+        talon = list(b[_W_BASE:_W_BASE + wl])
+        talon.extend(b[_S_BASE:_S_BASE + b[_S_LEN]][::-1])
+        hashes = _symmetric_hashes(
+            [b[_T_BASE + i * _COL_CAP:_T_BASE + i * _COL_CAP + b[i]]
+             for i in range(7)],
+            b[_F_LEN:_F_LEN + 4], talon, wl)
+        h = min(hashes)
+        return h, hashes.index(h)
+
+    def permute_suits(self, k: int) -> 'CompactSolitaireState':
+        perm, table = SUIT_SYMMETRIES[k], _SYM_CODE[k]
+        s = self.clone()
+        b = s.buf
+        # Card areas only: the length bytes are not card codes
+        b[_T_BASE:] = self.buf[_T_BASE:].translate(table)
+        for sv in range(4):
+            b[_F_LEN + perm[sv]] = self.buf[_F_LEN + sv]
+        s.rehash()
+        return s
+
+    def get_reachable_talon_cards(self) -> Set[Tuple[int, int]]:
+        reachable = set()
+        for _, c in self._talon_tops():
+            reachable.add((c >> 2, c & 3))
+        return reachable
+
+    def _talon_tops(self):
+        b = self.buf
+        wl = b[_W_LEN]
+        n = wl + b[_S_LEN]
+        w0 = _W_BASE - 1
+        s0 = _S_BASE + n
+        return [(turns, b[w0 + p] if p <= wl else b[s0 - p])
+                for turns, p in TalonCycle.steps(n, wl)]
+
+    def is_relaxed_solvable(self) -> bool:
+        b = self.buf
+        return _relaxed_solvable(
+            [b[_T_BASE + i * _COL_CAP:_T_BASE + i * _COL_CAP + b[i]] for i in range(7)],
+            b[_F_LEN:_F_LEN + 4])
+
+    def can_foundation_return(self, card_rank: int) -> bool:
+        if card_rank <= 2:
+            return False
+        target = card_rank - 2
+        b = self.buf
+        for sv in range(4):
+            if b[_F_LEN + sv] < target:
+                return True
+        return False
+
+    def _first_empty_col(self) -> Optional[int]:
+        b = self.buf
+        for i in range(7):
+            if not b[_T_LEN + i]:
+                return i
+        return None
+
+    def uncovers_face_down(self, col_idx: int, num_cards: int) -> bool:
+        b = self.buf
+        remaining = b[_T_LEN + col_idx] - num_cards
+        return remaining > 0 and \
+            not b[_T_BASE + col_idx * _COL_CAP + remaining - 1] & FACE_UP_BIT
+
+    # ----------------------------------------------------------------
+    # Move Generation: same order and priorities as SolitaireState, so
+    # both backends consume rng.shuffle identically.
+    # ----------------------------------------------------------------
+    def get_ordered_moves(self, rng=random) -> List[Move]:
+        first_empty_for_king = self._first_empty_col()
+        tops = self._col_tops()
+        all_moves = self._tableau_moves(first_empty_for_king, tops)
+        self._talon_moves(all_moves, first_empty_for_king, tops)
+        rng.shuffle(all_moves)
+        all_moves.sort(key=lambda m: m.priority)
+        return all_moves
+
+    def iter_ordered_moves(self, rng=random) -> Iterator[Move]:
+        first_empty_for_king = self._first_empty_col()
+        tops = self._col_tops()
+        return _iter_buckets(self._tableau_moves(first_empty_for_king, tops),
+                             lambda moves: self._talon_moves(
+                                 moves, first_empty_for_king, tops), rng)
+
+    def _col_tops(self) -> List[int]:
+        """Top card code of each column, 0 for empty columns."""
+        b = self.buf
+        return [b[_T_BASE + ti * _COL_CAP + b[ti] - 1] if b[ti] else 0
+                for ti in range(7)]
+
+    def _tableau_moves(self, first_empty_for_king, tops) -> List[Move]:
+        b = self.buf
+        all_moves: List[Move] = []
+
+        # --- Tableau moves ---
+        for i in range(7):
+            col_len = b[i]
+            if not col_len:
+                continue
+            base = _T_BASE + i * _COL_CAP
+            top = tops[i]
+
+            # Tableau → Foundation
+            f_idx = top & 3
+            if b[_F_LEN + f_idx] == ((top & CODE_MASK) >> 2) - 1:
+                reveals = col_len > 1 and not b[base + col_len - 2] & FACE_UP_BIT
+                all_moves.append(Move(
+                    ActionType.TABLEAU_TO_FOUNDATION, i, f_idx, CARD_BY_CODE[top],
+                    priority=1 if reveals else 2))
+
+            # Tableau → Tableau (partial and full stack moves)
+            for j in range(col_len):
+                moving = b[base + j]
+                if not moving & FACE_UP_BIT:
+                    continue
+                m_rank = (moving & CODE_MASK) >> 2
+                m_red = (moving & 3) < 2
+                reveals = j > 0 and not b[base + j - 1] & FACE_UP_BIT
+                king_at_bottom = (m_rank == 13 and j == 0)
+                n_cards = col_len - j
+                pri = 3 if reveals else 6
+                for ti in range(7):
+                    if ti == i:
+                        continue
+                    tt = tops[ti]
+                    if not tt:
+                        if m_rank == 13 and not king_at_bottom \
+                                and ti == first_empty_for_king:
+                            all_moves.append(Move(
+                                ActionType.TABLEAU_TO_TABLEAU, i, ti,
+                                CARD_BY_CODE[moving], num_cards=n_cards, priority=pri))
+                    elif tt & FACE_UP_BIT and m_rank == ((tt & CODE_MASK) >> 2) - 1 \
+                            and m_red != ((tt & 3) < 2):
+                        all_moves.append(Move(
+                            ActionType.TABLEAU_TO_TABLEAU, i, ti,
+                            CARD_BY_CODE[moving], num_cards=n_cards, priority=pri))
+
+        # --- Foundation → Tableau ---
+        for f_idx in range(4):
+            t_rank = b[_F_LEN + f_idx]
+            if not t_rank or not self.can_foundation_return(t_rank):
+                continue
+            top = CARD_BY_CODE[t_rank * 4 + f_idx | FACE_UP_BIT]
+            t_red = f_idx < 2
+            for ti in range(7):
+                tt = tops[ti]
+                if not tt:
+                    if t_rank == 13:
+                        all_moves.append(Move(
+                            ActionType.FOUNDATION_TO_TABLEAU, f_idx, ti,
+                            top, priority=5))
+                        break  # Only first empty for King
+                elif tt & FACE_UP_BIT and t_rank == ((tt & CODE_MASK) >> 2) - 1 \
+                        and t_red != ((tt & 3) < 2):
+                    all_moves.append(Move(
+                        ActionType.FOUNDATION_TO_TABLEAU, f_idx, ti,
+                        top, priority=5))
+        return all_moves
+
+    def _talon_moves(self, moves: List[Move], first_empty_for_king, tops):
+        found: Set = set()
+        for turns, code in self._talon_tops():
+            self._gen_waste_moves(
+                code, turns, moves, found, first_empty_for_king, tops)
+
+    def _gen_waste_moves(self, code, turns, moves, found, first_empty, tops):
+        card = CARD_BY_CODE[code]
+        c_rank = code >> 2
+        c_sv = code & 3
+
+        # Waste → Foundation
+        if self.buf[_F_LEN + c_sv] == c_rank - 1:
+            aid = ('WF', c_rank, c_sv)
+            if aid not in found:
+                moves.append(Move(ActionType.WASTE_TO_FOUNDATION, -1, c_sv,
+                                  card, stock_turns=turns, priority=2))
+                found.add(aid)
+
+        # Waste → Tableau
+        c_red = c_sv < 2
+        for ti in range(7):
+            tt = tops[ti]
+            if not tt:
+                ok = c_rank == 13 and ti == first_empty
+            else:
+                ok = tt & FACE_UP_BIT and c_rank == ((tt & CODE_MASK) >> 2) - 1 \
+                    and c_red != ((tt & 3) < 2)
+            if ok:
+                aid = ('WT', c_rank, c_sv, ti)
+                if aid not in found:
+                    moves.append(Move(ActionType.WASTE_TO_TABLEAU, -1, ti,
+                                      card, stock_turns=turns, priority=4))
+                    found.add(aid)
+
+    def apply_move(self, move: Move) -> tuple:
+        b = self.buf
+        undo_zh = self._zh
+        talon_split = -1
+        flipped = False
+        # K+ macro: cycle stock
+        if move.stock_turns > 0:
+            wl = talon_split = b[_W_LEN]
+            p = TalonCycle.advance(wl + b[_S_LEN], wl, move.stock_turns)
+            if p != wl:
+                old_top = b[_W_BASE + wl - 1] if wl else 0
+                self._split_talon(p)
+                self._zh ^= _Z_WTOP[old_top] ^ _Z_WTOP[b[_W_BASE + p - 1] if p else 0]
+
+        at = move.action_type
+        if at == ActionType.TABLEAU_TO_FOUNDATION:
+            src = move.src_idx
+            n = b[src] - 1
+            pos = _T_BASE + src * _COL_CAP + n
+            c = b[pos]
+            self._zh ^= _Z_TAB[(c * 7 + src) * _COL_CAP + n] \
+                ^ _Z_FOUND[c & CODE_MASK]
+            b[pos] = 0
+            b[src] = n
+            b[_F_LEN + move.dest_idx] += 1
+            flipped = self._flip_top(src)
+            if flipped or not n:
+                self._col_terms[src] = None
+        elif at == ActionType.TABLEAU_TO_TABLEAU:
+            src, dest, n = move.src_idx, move.dest_idx, move.num_cards
+            sk = b[src] - n
+            dk = b[dest]
+            s0 = _T_BASE + src * _COL_CAP + sk
+            d0 = _T_BASE + dest * _COL_CAP + dk
+            zh = self._zh
+            for k in range(n):
+                code7 = b[s0 + k] * 7
+                zh ^= _Z_TAB[(code7 + src) * _COL_CAP + sk + k] \
+                    ^ _Z_TAB[(code7 + dest) * _COL_CAP + dk + k]
+            self._zh = zh
+            b[d0:d0 + n] = b[s0:s0 + n]
+            b[s0:s0 + n] = _ZEROS[n]
+            b[src] = sk
+            b[dest] = dk + n
+            flipped = self._flip_top(src)
+            if flipped or not sk:
+                self._col_terms[src] = None
+            if not dk:
+                self._col_terms[dest] = None
+        elif at == ActionType.WASTE_TO_FOUNDATION:
+            c = self._pop_waste()
+            self._zh ^= _Z_FOUND[c]
+            b[_F_LEN + move.dest_idx] += 1
+        elif at == ActionType.WASTE_TO_TABLEAU:
+            c = self._pop_waste() | FACE_UP_BIT
+            dest = move.dest_idx
+            dk = b[dest]
+            self._zh ^= _Z_TAB[(c * 7 + dest) * _COL_CAP + dk]
+            b[_T_BASE + dest * _COL_CAP + dk] = c
+            b[dest] = dk + 1
+            if not dk:
+                self._col_terms[dest] = None
+        elif at == ActionType.FOUNDATION_TO_TABLEAU:
+            src = move.src_idx
+            rank = b[_F_LEN + src]
+            b[_F_LEN + src] = rank - 1
+            c = rank * 4 + src | FACE_UP_BIT
+            dest = move.dest_idx
+            dk = b[dest]
+            self._zh ^= _Z_FOUND[c & CODE_MASK] \
+                ^ _Z_TAB[(c * 7 + dest) * _COL_CAP + dk]
+            b[_T_BASE + dest * _COL_CAP + dk] = c
+            b[dest] = dk + 1
+            if not dk:
+                self._col_terms[dest] = None
+        return (undo_zh, flipped, talon_split)
+
+    def undo_move(self, move: Move, undo: tuple):
+        zh, flipped, talon_split = undo
+        b = self.buf
+        terms = self._col_terms
+        at = move.action_type
+        if at == ActionType.TABLEAU_TO_FOUNDATION:
+            src, f = move.src_idx, _F_LEN + move.dest_idx
+            n = b[src]
+            pos = _T_BASE + src * _COL_CAP + n
+            if flipped:
+                b[pos - 1] &= CODE_MASK
+                self._fd |= 1 << b[pos - 1]
+            if flipped or not n:
+                terms[src] = None
+            b[pos] = b[f] * 4 + move.dest_idx | FACE_UP_BIT
+            b[f] -= 1
+            b[src] = n + 1
+        elif at == ActionType.TABLEAU_TO_TABLEAU:
+            src, dest, n = move.src_idx, move.dest_idx, move.num_cards
+            sk = b[src]
+            dk = b[dest] - n
+            s0 = _T_BASE + src * _COL_CAP + sk
+            d0 = _T_BASE + dest * _COL_CAP + dk
+            if flipped:
+                b[s0 - 1] &= CODE_MASK
+                self._fd |= 1 << b[s0 - 1]
+            if flipped or not sk:
+                terms[src] = None
+            if not dk:
+                terms[dest] = None
+            b[s0:s0 + n] = b[d0:d0 + n]
+            b[d0:d0 + n] = _ZEROS[n]
+            b[src] = sk + n
+            b[dest] = dk
+        elif at == ActionType.WASTE_TO_FOUNDATION:
+            f = _F_LEN + move.dest_idx
+            wl = b[_W_LEN]
+            b[_W_BASE + wl] = b[f] * 4 + move.dest_idx
+            b[_W_LEN] = wl + 1
+            b[f] -= 1
+        elif at == ActionType.WASTE_TO_TABLEAU:
+            dest = move.dest_idx
+            dk = b[dest] - 1
+            pos = _T_BASE + dest * _COL_CAP + dk
+            wl = b[_W_LEN]
+            b[_W_BASE + wl] = b[pos] & CODE_MASK
+            b[_W_LEN] = wl + 1
+            b[pos] = 0
+            b[dest] = dk
+            if not dk:
+                terms[dest] = None
+        elif at == ActionType.FOUNDATION_TO_TABLEAU:
+            dest = move.dest_idx
+            dk = b[dest] - 1
+            b[_T_BASE + dest * _COL_CAP + dk] = 0
+            b[dest] = dk
+            b[_F_LEN + move.src_idx] += 1
+            if not dk:
+                terms[dest] = None
+
+        # Stock cycling keeps waste + reversed(stock) fixed; re-split it
+        if talon_split >= 0:
+            self._split_talon(talon_split)
+        self._zh = zh
+
+    def _split_talon(self, waste_len: int):
+        """Rearrange the talon so the waste holds waste_len cards."""
+        b = self.buf
+        wl = b[_W_LEN]
+        talon = b[_W_BASE:_W_BASE + wl] + b[_S_BASE:_S_BASE + b[_S_LEN]][::-1]
+        stock = talon[waste_len:][::-1]
+        b[_W_BASE:_W_BASE + 24] = talon[:waste_len] + _ZEROS[24 - waste_len]
+        b[_S_BASE:_S_BASE + 24] = stock + _ZEROS[24 - len(stock)]
+        b[_W_LEN] = waste_len
+        b[_S_LEN] = len(stock)
+
+    def _pop_waste(self) -> int:
+        b = self.buf
+        wl = b[_W_LEN] - 1
+        c = b[_W_BASE + wl]
+        b[_W_BASE + wl] = 0
+        b[_W_LEN] = wl
+        prev = b[_W_BASE + wl - 1] if wl else _Z_START
+        sl = b[_S_LEN]
+        nxt = b[_S_BASE + sl - 1] if sl else _Z_END
+        self._zh ^= _Z_PAIR[prev * 64 + c] ^ _Z_PAIR[c * 64 + nxt] \
+            ^ _Z_PAIR[prev * 64 + nxt] \
+            ^ _Z_WTOP[c] ^ _Z_WTOP[prev if wl else 0]
+        return c
+
+    def _flip_top(self, col_idx) -> bool:
+        b = self.buf
+        n = b[col_idx] - 1
+        if n >= 0:
+            pos = _T_BASE + col_idx * _COL_CAP + n
+            c = b[pos]
+            if not c & FACE_UP_BIT:
+                b[pos] = c | FACE_UP_BIT
+                self._fd ^= 1 << c
+                self._zh ^= _Z_TAB[(c * 7 + col_idx) * _COL_CAP + n] \
+                    ^ _Z_TAB[((c | FACE_UP_BIT) * 7 + col_idx) * _COL_CAP + n]
+                return True
+        return False
+
+    def display(self):
+        self.to_state().display()
+
+# ==========================================
+# 4. Heuristic Evaluator (Paper Table 1)
 # ==========================================
 
 class HeuristicType(Enum):
     H1 = 0  # Opening
     H2 = 1  # Endgame
 
+# Feature 4 pairs in a face-down bitmask (bit = card code): the low bit of
+# each red (suits 0/1) and black (suits 2/3) same-rank pair.
+_PAIR_MASK = sum(1 << (rank * 4 + sv) for rank in range(1, 14) for sv in (0, 2))
+
 class Evaluator:
     """Paper Table 1: Per-card feature evaluation with 6 features."""
 
     @staticmethod
     def evaluate(state: SolitaireState, h_type: HeuristicType) -> float:
+        if isinstance(state, CompactSolitaireState):
+            return Evaluator._evaluate_compact(state, h_type)
         if state.is_win():
             return WIN_VALUE
 
@@ -522,74 +1498,936 @@ class Evaluator:
 
         return score
 
+    @staticmethod
+    def _evaluate_compact(state: CompactSolitaireState,
+                          h_type: HeuristicType) -> float:
+        """Same features as evaluate(), read straight from the card codes."""
+        if state.is_win():
+            return WIN_VALUE
+
+        b = state.buf
+        score = 0.0
+        is_h1 = (h_type == HeuristicType.H1)
+
+        # Feature 1: a foundation of height k holds ranks 1..k
+        for sv in range(4):
+            k = b[_F_LEN + sv]
+            score += (11 * k - k * k) // 2 if is_h1 else 5 * k
+
+        # Feature 3
+        if not is_h1:
+            score += len(state.get_reachable_talon_cards())
+
+        w4 = -5 if is_h1 else -1
+        w5 = -5 if is_h1 else -1
+        w6 = -10 if is_h1 else -5
+        face_down = [False] * 56
+        for ci in range(7):
+            base = _T_BASE + ci * _COL_CAP
+            col = b[base:base + b[ci]]
+            prev_up = False
+            for j, x in enumerate(col):
+                x_up = x & FACE_UP_BIT
+                x_id = x & CODE_MASK
+                x_rank = x_id >> 2
+                if not x_up:
+                    # Feature 2
+                    score += x_rank - 14
+                    face_down[x_id] = True
+                # Features 5 & 6: x blocks only if not resting on face-up card
+                if not prev_up:
+                    x_sv = x_id & 3
+                    x_red = x_sv < 2
+                    for i in range(j):
+                        y = col[i]
+                        y_rank = (y & CODE_MASK) >> 2
+                        if (y & 3) == x_sv and x_rank > y_rank:
+                            score += w5
+                        if x_rank < 13 and y_rank == x_rank + 1 \
+                                and ((y & 3) < 2) != x_red:
+                            score += w6
+                prev_up = x_up
+
+        # Feature 4: red pair is suits 0/1, black pair is suits 2/3
+        for rank in range(1, 14):
+            r4 = rank * 4
+            if face_down[r4] and face_down[r4 + 1]:
+                score += w4
+            if face_down[r4 + 2] and face_down[r4 + 3]:
+                score += w4
+
+        return score
+
+    @staticmethod
+    def evaluate_incremental(state, h_type: HeuristicType) -> float:
+        """Same score as evaluate(), assembled from the terms the state keeps
+        up to date in apply_move()/undo_move(): per-column Features 2/5/6,
+        per-pile Feature 1 from the foundation heights and the Feature 4
+        pair count from the face-down bitmask."""
+        if state.is_win():
+            return WIN_VALUE
+
+        fd = state._fd
+        pairs = (fd & (fd >> 1) & _PAIR_MASK).bit_count()
+        if h_type == HeuristicType.H1:
+            score = -5 * pairs
+            for k in state.foundation_heights():
+                score += (11 * k - k * k) // 2
+            for t in state.column_terms():
+                score += t[0]
+        else:
+            score = 5 * sum(state.foundation_heights()) - pairs
+            score += len(state.get_reachable_talon_cards())
+            for t in state.column_terms():
+                score += t[1]
+        return float(score)
+
+    @staticmethod
+    def column_terms(col) -> Tuple[int, int]:
+        """Features 2, 5 and 6 of one column of card codes, as (H1, H2)
+        score terms. Only face-down cards and the first face-up card can
+        block, so nothing above that card contributes."""
+        f2 = n5 = n6 = 0
+        for j, x in enumerate(col):
+            x_id = x & CODE_MASK
+            x_rank = x_id >> 2
+            x_sv = x_id & 3
+            x_red = x_sv < 2
+            for i in range(j):
+                y = col[i] & CODE_MASK
+                y_rank = y >> 2
+                if (y & 3) == x_sv and x_rank > y_rank:
+                    n5 += 1
+                # No card has rank 14, so a King never matches here
+                if y_rank == x_rank + 1 and ((y & 3) < 2) != x_red:
+                    n6 += 1
+            if x & FACE_UP_BIT:
+                break
+            f2 += x_rank - 14
+        return (f2 - 5 * n5 - 10 * n6, f2 - n5 - 5 * n6)
+
+# ==========================================
+# 5. Transposition Table and Search Path
 # ==========================================
-# 4. Multistage Nested Rollout Solver
+
+class TranspositionTable:
+    """Bounded map from search keys to the best value seen for them.
+
+    policy 'lru' evicts the least recently used entry; 'clock' is the
+    second-chance approximation of LRU (cheaper hits, no reordering).
+    probe() counts hits and misses; evictions are counted on insert.
+    A capacity of 0 disables the table."""
+
+    POLICIES = ('lru', 'clock')
+
+    def __init__(self, capacity: int = 5000, policy: str = 'lru'):
+        if policy not in self.POLICIES:
+            raise ValueError(f"unknown cache policy {policy!r}, "
+                             f"expected one of {self.POLICIES}")
+        self.capacity = capacity
+        self.policy = policy
+        self.clear()
+
+    def clear(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # lru: key -> value in recency order
+        self._lru: OrderedDict = OrderedDict()
+        # clock: key -> slot, with per-slot keys, values and reference bits
+        self._slots: Dict = {}
+        self._keys: list = []
+        self._vals: list = []
+        self._ref = bytearray(max(self.capacity, 0))
+        self._hand = 0
+
+    def __len__(self):
+        return len(self._lru) if self.policy == 'lru' else len(self._slots)
+
+    def __contains__(self, key) -> bool:
+        """Membership test without touching counters or recency."""
+        return key in (self._lru if self.policy == 'lru' else self._slots)
+
+    def probe(self, key) -> bool:
+        """Look key up, counting a hit or miss and marking it as used."""
+        if self.policy == 'lru':
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return True
+        else:
+            slot = self._slots.get(key)
+            if slot is not None:
+                self._ref[slot] = 1
+                self.hits += 1
+                return True
+        self.misses += 1
+        return False
+
+    def lookup(self, key):
+        """probe() that also returns the stored value (None on a miss)."""
+        if self.policy == 'lru':
+            val = self._lru.get(key)
+            if val is not None:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return val
+        else:
+            slot = self._slots.get(key)
+            if slot is not None and self._vals[slot] is not None:
+                self._ref[slot] = 1
+                self.hits += 1
+                return self._vals[slot]
+        self.misses += 1
+        return None
+
+    def get(self, key, default=None):
+        """Best value stored for key (None until one is recorded)."""
+        if self.policy == 'lru':
+            return self._lru.get(key, default)
+        slot = self._slots.get(key)
+        return default if slot is None else self._vals[slot]
+
+    def store(self, key, value: Optional[float] = None):
+        """Insert key, or raise its value to `value` if that is better."""
+        if self.capacity <= 0:
+            return
+        if self.policy == 'lru':
+            lru = self._lru
+            if key in lru:
+                old = lru[key]
+                if value is not None and (old is None or value > old):
+                    lru[key] = value
+                lru.move_to_end(key)
+                return
+            lru[key] = value
+            if len(lru) > self.capacity:
+                lru.popitem(last=False)
+                self.evictions += 1
+            return
+
+        slot = self._slots.get(key)
+        if slot is not None:
+            old = self._vals[slot]
+            if value is not None and (old is None or value > old):
+                self._vals[slot] = value
+            self._ref[slot] = 1
+            return
+        if len(self._keys) < self.capacity:
+            slot = len(self._keys)
+            self._keys.append(key)
+            self._vals.append(value)
+        else:
+            ref = self._ref
+            hand = self._hand
+            while ref[hand]:
+                ref[hand] = 0
+                hand = (hand + 1) % self.capacity
+            slot = hand
+            self._hand = (hand + 1) % self.capacity
+            del self._slots[self._keys[slot]]
+            self._keys[slot] = key
+            self._vals[slot] = value
+            self.evictions += 1
+        self._slots[key] = slot
+        self._ref[slot] = 1
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {'size': len(self), 'capacity': self.capacity,
+                'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+class PathSet:
+    """Hashes of the positions on the current search path (loop detection).
+
+    One instance is shared by the whole recursion: a _search call push()es
+    the positions it visits and unwind()s to its mark() before returning,
+    so push, pop and membership are O(1) instead of a frozenset copy per
+    advance. Hashes are counted, so pushing one twice is harmless."""
+
+    __slots__ = ('_counts', '_stack')
+
+    def __init__(self, hashes=()):
+        self._counts: Dict[int, int] = {}
+        self._stack: List[int] = []
+        for h in hashes:
+            self.push(h)
+
+    def __contains__(self, h) -> bool:
+        return h in self._counts
+
+    def __len__(self):
+        return len(self._counts)
+
+    def push(self, h: int):
+        self._stack.append(h)
+        counts = self._counts
+        counts[h] = counts.get(h, 0) + 1
+
+    def mark(self) -> int:
+        return len(self._stack)
+
+    def unwind(self, mark: int):
+        """Pop every hash pushed since mark() returned `mark`."""
+        stack, counts = self._stack, self._counts
+        while len(stack) > mark:
+            h = stack.pop()
+            k = counts[h] - 1
+            if k:
+                counts[h] = k
+            else:
+                del counts[h]
+
+    def exclude(self, h: int) -> int:
+        """Hide h from membership tests; returns the count for include()."""
+        return self._counts.pop(h, 0)
+
+    def include(self, h: int, count: int):
+        """Undo exclude(h)."""
+        if count:
+            self._counts[h] = count
+
+    def snapshot(self) -> frozenset:
+        return frozenset(self._counts)
+
+# ==========================================
+# 6. Multistage Nested Rollout Solver
 #    (Paper Figure 9)
 # ==========================================
 
+class Deadline:
+    """Search budget in seconds and/or searched nodes.
+
+    The clock (time.perf_counter, unaffected by wall-clock adjustments) is
+    read only on every check_interval-th expired() call, so a time budget
+    can overrun by that many checks. The node budget is tested on every
+    call and does not depend on machine speed. Once expired, a deadline stays expired;
+    cancel() expires it early."""
+
+    def __init__(self, seconds: Optional[float] = None,
+                 max_nodes: Optional[int] = None, check_interval: int = 64):
+        self.seconds = seconds
+        self.max_nodes = max_nodes
+        self.check_interval = max(1, check_interval)
+        self.start()
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        self._end = (float('inf') if self.seconds is None
+                     else self.start_time + self.seconds)
+        self._countdown = 0
+        self._expired = False
+
+    def expired(self, nodes: int = 0) -> bool:
+        """True once the budget is spent; `nodes` is the count searched so far."""
+        if self._expired:
+            return True
+        if self.max_nodes is not None and nodes >= self.max_nodes:
+            self._expired = True
+            return True
+        self._countdown -= 1
+        if self._countdown <= 0:
+            self._countdown = self.check_interval
+            if time.perf_counter() >= self._end:
+                self._expired = True
+        return self._expired
+
+    def cancel(self):
+        self._expired = True
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start_time
+
+    def remaining(self) -> float:
+        """Seconds left (inf without a time budget, 0 once expired)."""
+        if self._expired:
+            return 0.0
+        return max(0.0, self._end - time.perf_counter())
+
+    def remaining_nodes(self, nodes: int) -> Optional[int]:
+        if self.max_nodes is None:
+            return None
+        return max(0, self.max_nodes - nodes)
+
+@dataclass
+class SearchStats:
+    """Profile of one solve() with profile=True.
+
+    timers maps an operation to [calls, seconds]. Times are inclusive
+    (apply_move contains its own talon work), so they do not add up to the
+    total. level_nodes counts _search calls per (heuristic index, level n).
+    heuristic_switches counts switches from H1 to H2."""
+    timers: Dict[str, List[float]] = field(default_factory=dict)
+    level_nodes: Dict[Tuple[int, int], int] = field(default_factory=dict)
+    heuristic_switches: int = 0
+    nodes: int = 0
+    elapsed: float = 0.0
+    caches: List[Dict[str, float]] = field(default_factory=list)
+    eval_cache: Optional[Dict[str, float]] = None
+    relaxed_cache: Optional[Dict[str, float]] = None
+
+    # State methods timed by the profiling subclass, by report name
+    STATE_METHODS = {'get_ordered_moves': 'move_gen',
+                     'iter_ordered_moves': 'move_gen',
+                     '_tableau_moves': 'tableau',
+                     '_talon_moves': 'talon_moves', '_talon_tops': 'talon',
+                     'clone': 'clone', 'apply_move': 'apply_move',
+                     'state_hash': 'state_hash'}
+
+    def timer(self, name: str) -> List[float]:
+        return self.timers.setdefault(name, [0, 0.0])
+
+    def timed(self, fn, name: str):
+        """fn wrapped to add its calls and run time to timers[name]."""
+        rec = self.timer(name)
+        perf_counter = time.perf_counter
+
+        def wrapper(*args, **kwargs):
+            t0 = perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                rec[0] += 1
+                rec[1] += perf_counter() - t0
+        wrapper.__wrapped__ = fn
+        return wrapper
+
+    def state_class(self, base: type) -> type:
+        """Subclass of a state backend whose hot methods are timed. Its
+        instances pickle as `base`, since the class is built at run time
+        and cannot be looked up by name (e.g. in a worker process)."""
+        methods = {attr: self.timed(getattr(base, attr), name)
+                   for attr, name in self.STATE_METHODS.items()}
+
+        def __reduce__(state):
+            return base.__new__, (base,), state.__dict__
+
+        methods['__reduce__'] = __reduce__
+        return type('Profiled' + base.__name__, (base,), methods)
+
+    def report(self) -> str:
+        lines = [f"{self.nodes} nodes in {self.elapsed:.2f}s "
+                 f"({self.nodes / self.elapsed if self.elapsed else 0:.0f}/s), "
+                 f"{self.heuristic_switches} heuristic switches"]
+        for name, (calls, secs) in sorted(self.timers.items(),
+                                          key=lambda kv: -kv[1][1]):
+            per = secs / calls * 1e6 if calls else 0.0
+            lines.append(f"  {name:<12} {calls:>9} calls {secs:8.3f}s "
+                         f"{per:7.2f}us/call")
+        for (h_idx, n), count in sorted(self.level_nodes.items()):
+            lines.append(f"  H{h_idx + 1} n={n:<3} {count:>9} searches")
+        for i, c in enumerate(self.caches):
+            lines.append(f"  cache H{i + 1}: {c['hit_rate']:.1%} hits, "
+                         f"{c['evictions']} evictions")
+        for name, c in (('eval memo', self.eval_cache),
+                        ('relaxed', self.relaxed_cache)):
+            if c is not None and c['hits'] + c['misses']:
+                lines.append(f"  {name}: {c['hit_rate']:.1%} hits")
+        return '\n'.join(lines)
+
 class MultistageNestedRolloutSolver:
+    RELAXED_CACHE_CAPACITY = 20000
+
     def __init__(self, root_state: SolitaireState,
-                 max_time: int = 60, n0: int = 1, n1: int = 1):
+                 max_time: Optional[float] = 60, n0: int = 1, n1: int = 1,
+                 max_nodes: Optional[int] = None, check_interval: int = 64,
+                 make_unmake: bool = False,
+                 cache_capacity: Union[int, Sequence[int]] = 5000,
+                 cache_policy: str = 'lru',
+                 eval_cache_capacity: int = 20000,
+                 relaxed_prune: Optional[int] = None,
+                 anytime: bool = False,
+                 seed: Optional[int] = 0,
+                 profile: bool = False,
+                 on_move: Optional[Callable[[int, Move], None]] = None,
+                 on_progress: Optional[Callable[[Dict], None]] = None,
+                 progress_interval: float = 1.0,
+                 lazy_moves: bool = True,
+                 batch_eval: bool = False,
+                 symmetric_cache: bool = False):
         self.root = root_state
+        # Budget: max_time seconds and/or max_nodes searched nodes, whichever
+        # runs out first (None = unlimited). solve() starts self.deadline.
         self.max_time = max_time
+        self.max_nodes = max_nodes
+        self.check_interval = check_interval
+        self.deadline = Deadline(max_time, max_nodes, check_interval)
+        # Move-order ties are shuffled by a Random(seed) private to the
+        # solver and reset by every solve(); seed=None uses the global
+        # random module instead. With max_time=None and a max_nodes budget
+        # the search and its solution are identical on every run and machine.
+        self.seed = seed
+        self.rng = random if seed is None else random.Random(seed)
         self.n_levels = [n0, n1]
-        self.start_time = 0.0
         self.h_types = [HeuristicType.H1, HeuristicType.H2]
-        # Cache: set of (state_hash, h_idx, n) — up to 5000 per heuristic
-        self.caches: List[Set] = [set(), set()]
-        self.cache_limit = 5000
+        # Cache per heuristic: keys (state_hash, n) of the positions
+        # searched at n > 0. A hit moves on to the next heuristic (Paper
+        # Fig 9 lines 4-6); no value is kept.
+        # cache_capacity is one size for both levels or one per level.
+        if isinstance(cache_capacity, int):
+            cache_capacity = [cache_capacity] * len(self.h_types)
+        self.cache_capacity = list(cache_capacity)
+        self.cache_policy = cache_policy
+        self.caches: List[TranspositionTable] = [
+            TranspositionTable(cap, cache_policy) for cap in self.cache_capacity]
+        # symmetric_cache: key the caches by canonical_hash(), so positions
+        # that differ by a suit swap share an entry. Cached values are
+        # orientation free; computing the key costs about four rehashes,
+        # paid only at the cache probe of each search call.
+        self.symmetric_cache = symmetric_cache
+        # Evaluation memo: (state_hash, h_type) -> Evaluator score. With a
+        # capacity of 0 the solver calls Evaluator.evaluate_incremental
+        # directly.
+        self.eval_cache: Optional[TranspositionTable] = None
+        self._evaluate = Evaluator.evaluate_incremental
+        if eval_cache_capacity > 0:
+            self.eval_cache = TranspositionTable(eval_cache_capacity,
+                                                 cache_policy)
+            self._evaluate = self._evaluate_memo
+        # Relaxed-domain pruning (Paper Sec 4.1): states searched at level
+        # n >= relaxed_prune that fail is_relaxed_solvable() score
+        # LOSS_VALUE. The root is checked whatever its level, and solve()
+        # returns no moves for a relaxed dead end. None disables it.
+        self.relaxed_prune = relaxed_prune
+        self.relaxed_cache = TranspositionTable(self.RELAXED_CACHE_CAPACITY,
+                                                cache_policy)
+        self.relaxed_pruned = 0
         self.final_state: Optional[SolitaireState] = None
         self.nodes_searched = 0
+        # make_unmake: search children on one shared state and roll it back
+        # with undo_move() instead of cloning a state per child.
+        self.make_unmake = make_unmake
+        self._trail: Optional[List[Tuple[Move, tuple]]] = None
+        # anytime: ignore n0/n1 and search from the root at escalating levels
+        # (0,0), (1,0), (1,1), (2,1), ... until a win or the deadline.
+        # rounds records (n0, n1, win, foundation cards) per level pair.
+        self.anytime = anytime
+        self.rounds: List[Tuple[int, int, bool, int]] = []
+        # profile: time state operations and count searches per level into
+        # self.stats (a SearchStats). Profiling swaps in wrapped methods and
+        # a state subclass for one solve(), so it costs nothing when off.
+        self.profile = profile
+        self.stats: Optional[SearchStats] = None
+        # Streaming: on_move(index, move) for each move committed at the top
+        # level, as soon as it is committed; in anytime mode index restarts
+        # at 0 with every round, and solve() returns the best round, which
+        # may be an earlier one. on_progress(event) every progress_interval
+        # seconds and once at the end (event['done'] is True); see
+        # _progress_event(). Either callback may call cancel().
+        self.on_move = on_move
+        self.on_progress = on_progress
+        self.progress_interval = progress_interval
+        self.top_moves = 0
+        self.top_foundation = 0
+        self.top_value = 0.0
+        # lazy_moves: take moves from iter_ordered_moves(), so a search
+        # that stops early (a WIN, the deadline, a level -1 leaf) skips the
+        # rest of move generation. False uses the eager get_ordered_moves(),
+        # whose move order, and so search, differs.
+        self.lazy_moves = lazy_moves
+        # batch_eval: score the children of a level-0 node, all leaves, in
+        # one batch_eval.evaluate_states() call (needs NumPy) instead of
+        # one search per child. Values and move choice are unchanged, but
+        # profiling does not count the leaves as level -1 searches.
+        self.batch_eval = batch_eval
+        self._evaluate_states = None
+        if batch_eval:
+            from batch_eval import evaluate_states, np
+            if np is None:
+                raise ImportError('batch_eval=True needs NumPy')
+            self._evaluate_states = evaluate_states
+
+    @staticmethod
+    def _move_sig(m: Move) -> int:
+        """Comparable signature for a move (see _SIG_MASK)."""
+        return ((m.action_type._value_ << 17 | (m.src_idx + 1) << 14
+                 | m.dest_idx << 11 | m.card._code << 4 | m.num_cards)
+                & _SIG_MASK)
+
+    def _legal_moves(self, state, reverse_sig) -> Iterator[Move]:
+        """Moves to search from `state`, best first, without the reverse
+        of the last move (signature reverse_sig) unless it is the only one.
+        Paper Sec 4.4 local loop prevention."""
+        if self.lazy_moves:
+            moves = state.iter_ordered_moves(self.rng)
+            if reverse_sig is None:
+                return moves
+            return self._skip_reverse(moves, reverse_sig)
+        legal = state.get_ordered_moves(self.rng)
+        if reverse_sig is not None:
+            filtered = self._drop_reverse(legal, reverse_sig)
+            if filtered:
+                legal = filtered
+        return iter(legal)
+
+    @staticmethod
+    def _skip_reverse(moves: Iterator[Move], sig: int) -> Iterator[Move]:
+        """Lazy _drop_reverse(): the reverse move is only yielded, last,
+        if no other move was."""
+        code = sig >> 4 & CODE_MASK | FACE_UP_BIT
+        move_sig = MultistageNestedRolloutSolver._move_sig
+        reverse = None
+        others = False
+        for m in moves:
+            if m.card._code != code or move_sig(m) != sig:
+                others = True
+                yield m
+            else:
+                reverse = m
+        if reverse is not None and not others:
+            yield reverse
+
+    @staticmethod
+    def _peek(moves: Iterator[Move]) -> Optional[Iterator[Move]]:
+        """`moves` as it was, or None if it is empty."""
+        for first in moves:
+            return chain((first,), moves)
+        return None
 
     @staticmethod
-    def _move_sig(m: Move) -> tuple:
-        """Comparable signature for a move."""
-        return (m.action_type, m.src_idx, m.dest_idx,
-                m.card.rank, m.card._sv, m.num_cards)
+    def _drop_reverse(legal: List[Move], sig: int) -> List[Move]:
+        """`legal` without the move whose signature is `sig`."""
+        # Most moves already differ in the card, so only those with the
+        # reverse move's card pay for a full signature. Moved cards are
+        # always face up.
+        code = sig >> 4 & CODE_MASK | FACE_UP_BIT
+        move_sig = MultistageNestedRolloutSolver._move_sig
+        return [m for m in legal if m.card._code != code or move_sig(m) != sig]
 
     @staticmethod
     def _get_reverse_sig(move: Move, state: SolitaireState):
         """Compute signature of the reverse move, or None if not reversible.
         Must be called BEFORE apply_move (needs pre-move state)."""
         at = move.action_type
+        code = move.card._code
 
         if at == ActionType.TABLEAU_TO_TABLEAU:
-            src_col = state.tableau[move.src_idx]
-            remaining = len(src_col) - move.num_cards
             # If removing cards reveals a face-down card, flip changes state
-            if remaining > 0 and not src_col[remaining - 1].face_up:
+            if state.uncovers_face_down(move.src_idx, move.num_cards):
                 return None  # flip => not reversible
-            return (ActionType.TABLEAU_TO_TABLEAU, move.dest_idx, move.src_idx,
-                    move.card.rank, move.card._sv, move.num_cards)
+            return pack_move(ActionType.TABLEAU_TO_TABLEAU.value, move.dest_idx,
+                             move.src_idx, code, move.num_cards) & _SIG_MASK
 
         if at == ActionType.TABLEAU_TO_FOUNDATION:
-            src_col = state.tableau[move.src_idx]
-            if len(src_col) > 1 and not src_col[-2].face_up:
+            if state.uncovers_face_down(move.src_idx, 1):
                 return None  # flip => not reversible
-            return (ActionType.FOUNDATION_TO_TABLEAU, move.dest_idx, move.src_idx,
-                    move.card.rank, move.card._sv, 1)
+            return pack_move(ActionType.FOUNDATION_TO_TABLEAU.value, move.dest_idx,
+                             move.src_idx, code) & _SIG_MASK
 
         if at == ActionType.FOUNDATION_TO_TABLEAU:
-            return (ActionType.TABLEAU_TO_FOUNDATION, move.dest_idx, move.src_idx,
-                    move.card.rank, move.card._sv, 1)
+            return pack_move(ActionType.TABLEAU_TO_FOUNDATION.value, move.dest_idx,
+                             move.src_idx, code) & _SIG_MASK
 
         # Waste moves are not reversible (can't put cards back in waste)
         return None
 
     def solve(self) -> List[Move]:
-        self.start_time = time.time()
-        self.caches = [set(), set()]
+        self.deadline = Deadline(self.max_time, self.max_nodes,
+                                 self.check_interval)
+        if self.seed is not None:
+            self.rng.seed(self.seed)
+        for cache in self.caches:
+            cache.clear()
+        if self.eval_cache is not None:
+            self.eval_cache.clear()
+        self.relaxed_cache.clear()
+        self.relaxed_pruned = 0
         self.nodes_searched = 0
+        self.rounds = []
+        if self.profile:
+            self._begin_profile()
+        if self.on_progress is not None:
+            self._begin_progress()
+        try:
+            if self.relaxed_prune is not None and self._relaxed_dead(
+                    self.root, self.root.state_hash(), self.relaxed_prune):
+                # Unsolvable even in the relaxed game: nothing to search
+                self.final_state = self.root.clone()
+                return []
+            if self.anytime:
+                return self._solve_anytime()
+            moves, self.final_state = self._search_root()
+            return moves
+        finally:
+            if self.on_progress is not None:
+                del self._time_up
+                self.on_progress(self._progress_event(done=True))
+            if self.profile:
+                self._end_profile()
+
+    def cancel(self):
+        """Stop the running solve() at its next time check (thread-safe)."""
+        self.deadline.cancel()
+
+    def _progress_event(self, done: bool = False) -> Dict:
+        return {'nodes': self.nodes_searched,
+                'elapsed': self.deadline.elapsed(),
+                'moves': self.top_moves,
+                'foundation': self.top_foundation,
+                'value': self.top_value,
+                'levels': tuple(self.n_levels),
+                'done': done}
+
+    def _begin_progress(self):
+        time_up = type(self)._time_up
+        interval = self.progress_interval
+        perf_counter = time.perf_counter
+        countdown = [0]
+        next_event = [perf_counter() + interval]
+
+        def time_up_with_progress():
+            countdown[0] -= 1
+            if countdown[0] <= 0:
+                countdown[0] = self.check_interval
+                now = perf_counter()
+                if now >= next_event[0]:
+                    next_event[0] = now + interval
+                    self.on_progress(self._progress_event())
+            return time_up(self)
+
+        # Shadows the method for this solve() only (removed in solve())
+        self._time_up = time_up_with_progress
+
+    def _top_level_commit(self, state, moves: List[Move], value: float):
+        """Record moves just committed at the top level and stream them."""
+        on_move = self.on_move
+        for m in moves:
+            if on_move is not None:
+                on_move(self.top_moves, m)
+            self.top_moves += 1
+        self.top_foundation = sum(state.foundation_heights())
+        self.top_value = value
+
+    def _begin_profile(self):
+        stats = self.stats = SearchStats()
+        search = type(self)._search
+        levels = stats.level_nodes
+
+        def counted_search(state, h_idx, n_override, path, *args, **kwargs):
+            key = (h_idx, n_override)
+            levels[key] = levels.get(key, 0) + 1
+            # Only a heuristic switch enters a later heuristic at its full level
+            if h_idx and n_override == self.n_levels[h_idx]:
+                stats.heuristic_switches += 1
+            return search(self, state, h_idx, n_override, path, *args, **kwargs)
+
+        # Instance attributes shadow the methods for this solve() only
+        self._search = counted_search
+        self._evaluate = stats.timed(self._evaluate, 'evaluate')
+        self._profiled_classes: Dict[type, type] = {}
+
+    def _end_profile(self):
+        del self._search
+        self._evaluate = self._evaluate.__wrapped__
+        stats = self.stats
+        stats.nodes = self.nodes_searched
+        stats.elapsed = self.deadline.elapsed()
+        stats.caches = self.cache_stats()
+        if self.eval_cache is not None:
+            stats.eval_cache = self.eval_cache.stats()
+        stats.relaxed_cache = self.relaxed_cache.stats()
+        final = self.final_state
+        if final is not None and type(final) in self._profiled_classes.values():
+            final.__class__ = type(final).__mro__[1]
+
+    def _search_root(self) -> Tuple[List[Move], SolitaireState]:
+        """One search from the root at the current n_levels."""
+        self._trail = [] if self.make_unmake else None
         state = self.root.clone()
+        self.top_moves = 0
+        self.top_foundation = sum(state.foundation_heights())
+        self.top_value = 0.0
+        if self.stats is not None and self.profile:
+            base = type(state)
+            profiled = self._profiled_classes.get(base)
+            if profiled is None:
+                profiled = self._profiled_classes[base] = self.stats.state_class(base)
+            state.__class__ = profiled
         val, moves = self._search(state, h_idx=0,
                                   n_override=self.n_levels[0],
-                                  path=frozenset(),
+                                  path=PathSet(),
                                   top_level=True)
-        self.final_state = state
-        return moves
+        self._trail = None
+        return moves, state
+
+    def _solve_anytime(self) -> List[Move]:
+        """Escalate nesting levels while time remains and return the best
+        round: a win, else the most foundation cards, else the higher H2
+        score. The evaluation memo and relaxed verdicts are kept between
+        rounds; the level caches are cleared, since they mark positions
+        already searched and a hit skips to the next heuristic."""
+        levels = self.n_levels
+        best = None
+        n0 = n1 = 0
+        try:
+            while True:
+                self.n_levels = [n0, n1]
+                for cache in self.caches:
+                    cache.clear()
+                moves, state = self._search_root()
+                won = state.is_win()
+                fc = sum(state.foundation_heights())
+                self.rounds.append((n0, n1, won, fc))
+                score = (won, fc, self._evaluate(state, self.h_types[-1]))
+                if best is None or score > best[0]:
+                    best = (score, moves, state)
+                if won or self._time_up():
+                    break
+                if n0 == n1:
+                    n0 += 1
+                else:
+                    n1 += 1
+        finally:
+            self.n_levels = levels
+        self.final_state = best[2]
+        return best[1]
+
+    def cache_stats(self) -> List[Dict[str, float]]:
+        """Hit/miss/eviction counters of each heuristic level's cache."""
+        return [cache.stats() for cache in self.caches]
+
+    def _evaluate_memo(self, state, h_type: HeuristicType) -> float:
+        key = (state.state_hash(), h_type)
+        val = self.eval_cache.lookup(key)
+        if val is None:
+            val = Evaluator.evaluate_incremental(state, h_type)
+            self.eval_cache.store(key, val)
+        return val
+
+    def _relaxed_dead(self, state, sh: int, n: int) -> bool:
+        """True if pruning applies at level n and the state is a relaxed
+        dead end. Verdicts are cached by state hash."""
+        if self.relaxed_prune is None or n < self.relaxed_prune:
+            return False
+        ok = self.relaxed_cache.lookup(sh)
+        if ok is None:
+            ok = state.is_relaxed_solvable()
+            self.relaxed_cache.store(sh, ok)
+        if not ok:
+            self.relaxed_pruned += 1
+        return not ok
+
+    def _time_up(self) -> bool:
+        return self.deadline.expired(self.nodes_searched)
+
+    def _commit(self, state, move: Move):
+        """Apply move to a searched state, recording it for _unwind()."""
+        undo = state.apply_move(move)
+        if self._trail is not None:
+            self._trail.append((move, undo))
+
+    def _unwind(self, state, mark: int):
+        """Undo trail entries back to length mark (make/unmake mode)."""
+        trail = self._trail
+        while len(trail) > mark:
+            move, undo = trail.pop()
+            state.undo_move(move, undo)
+
+    def _evaluate_children(self, state, legal: Iterable[Move], h_idx: int,
+                           n: int, path: PathSet, top_level: bool):
+        """Paper Figure 9 lines 8-9: search each child at level n - 1.
+        Returns (best_val, best_move, best_sub); `state` is left unchanged."""
+        if n == 0 and self.batch_eval:
+            return self._evaluate_leaves(state, legal, h_idx, path)
+        best_val = LOSS_VALUE
+        best_move = None
+        best_sub = []
+
+        for a in legal:
+            # Time check inside loop
+            if self._time_up():
+                if best_move is None:
+                    best_move = a
+                    best_val = self._evaluate(state, self.h_types[h_idx])
+                break
+
+            child_reverse = self._get_reverse_sig(a, state)
+            trail = self._trail
+            if trail is not None:
+                mark = len(trail)
+                undo = state.apply_move(a)
+                trail.append((a, undo))
+                val, sub = self._search(state, h_idx, n - 1, path,
+                                        last_move_reverse=child_reverse)
+                if len(trail) > mark + 1:
+                    self._unwind(state, mark + 1)
+                trail.pop()
+                state.undo_move(a, undo)
+            else:
+                child = state.clone()
+                child.apply_move(a)
+                val, sub = self._search(child, h_idx, n - 1, path,
+                                        last_move_reverse=child_reverse)
+
+            if val > best_val:
+                best_val = val
+                best_move = a
+                best_sub = sub
+
+            # WIN shortcut: stop evaluating other children
+            if val == WIN_VALUE:
+                break
+
+        return best_val, best_move, best_sub
+
+    def _evaluate_leaves(self, state, legal: Iterable[Move], h_idx: int,
+                         path: PathSet):
+        """_evaluate_children() at n = 0 with the leaves scored as a batch.
+        Each child gets the checks of a level -1 _search(), and the result
+        is the one the child-by-child loop would return."""
+        h_type = self.h_types[h_idx]
+        cut = None
+        pending: List[Tuple[Move, object, int]] = []
+        for a in legal:
+            if self._time_up():
+                cut = a
+                break
+            child = state.clone()
+            child.apply_move(a)
+            self.nodes_searched += 1
+            if child.is_win():
+                return WIN_VALUE, a, []
+            sh = child.state_hash()
+            if sh in path or self._relaxed_dead(child, sh, -1):
+                continue  # LOSS_VALUE, never better than nothing
+            # Eager move generation draws from rng; keep the stream in step
+            # with _search()
+            if not self.lazy_moves:
+                self._legal_moves(child, None)
+            pending.append((a, child, sh))
+
+        vals: List[Optional[float]] = [None] * len(pending)
+        misses = []
+        if self.eval_cache is not None:
+            for i, (_, child, sh) in enumerate(pending):
+                vals[i] = self.eval_cache.lookup((sh, h_type))
+                if vals[i] is None:
+                    misses.append(i)
+        else:
+            misses = range(len(pending))
+        if misses:
+            scores = self._evaluate_states([pending[i][1] for i in misses],
+                                           h_type)
+            for i, val in zip(misses, scores):
+                vals[i] = val
+                if self.eval_cache is not None:
+                    self.eval_cache.store((pending[i][2], h_type), val)
+
+        best_val = LOSS_VALUE
+        best_move = None
+        for (a, _, _), val in zip(pending, vals):
+            if val > best_val:
+                best_val = val
+                best_move = a
+        if best_move is None and cut is not None:
+            best_move = cut
+            best_val = self._evaluate(state, h_type)
+        return best_val, best_move, []
 
     def _search(self, state: SolitaireState, h_idx: int,
-                n_override: int, path: frozenset,
+                n_override: int, path: PathSet,
                 top_level: bool = False,
                 last_move_reverse=None) -> Tuple[float, List[Move]]:
         """
@@ -616,134 +2454,121 @@ class MultistageNestedRolloutSolver:
         if sh in path:
             return (LOSS_VALUE, solution)
 
-        if time.time() - self.start_time > self.max_time:
-            return (Evaluator.evaluate(state, h_type), solution)
+        if self._relaxed_dead(state, sh, n):
+            return (LOSS_VALUE, solution)
 
-        legal = state.get_ordered_moves()
-        # Local loop prevention: filter reverse of last move (Paper Sec 4.4)
-        if last_move_reverse is not None:
-            filtered = [m for m in legal if self._move_sig(m) != last_move_reverse]
-            if filtered:
-                legal = filtered
-        if not legal:
-            return (Evaluator.evaluate(state, h_type), solution)
+        if self._time_up():
+            return (self._evaluate(state, h_type), solution)
 
+        # A leaf scores the same with or without moves. Only eager
+        # generation runs here, to draw from rng as it always has
         if n == -1:
-            return (Evaluator.evaluate(state, h_type), solution)
-
-        # === Lines 4-6: Cache check (ONCE on entry) ===
-        cache_key = (sh, n)
-        if cache_key in self.caches[h_idx]:
-            if z == 0:
-                return (Evaluator.evaluate(state, h_type), solution)
-            else:
-                # Pass path WITHOUT current state; new call starts at this state
-                val, sub = self._search(
-                    state, h_idx + 1, self.n_levels[h_idx + 1],
-                    path, top_level=top_level)
-                solution.extend(sub)
-                return (val, solution)
-
-        # Cache this node (only n > 0)
-        if n > 0 and len(self.caches[h_idx]) < self.cache_limit:
-            self.caches[h_idx].add(cache_key)
-
-        # === Lines 7-14: Main while loop ===
-        current_path = path | {sh}
-
-        while True:
-            # Track current state hash for heuristic switch
-            loop_sh = state.state_hash()
-
-            # Line 8-9: Evaluate children
-            best_val = LOSS_VALUE
-            best_move = None
-            best_sub = []
-
-            for a in legal:
-                # Time check inside loop
-                if time.time() - self.start_time > self.max_time:
-                    if best_move is None:
-                        best_move = a
-                        best_val = Evaluator.evaluate(state, h_type)
-                    break
-
-                child = state.clone()
-                child_reverse = self._get_reverse_sig(a, state)
-                child.apply_move(a)
-                val, sub = self._search(child, h_idx, n - 1, current_path,
-                                        last_move_reverse=child_reverse)
-
-                if val > best_val:
-                    best_val = val
-                    best_move = a
-                    best_sub = sub
-
-                # WIN shortcut: stop evaluating other children
-                if val == WIN_VALUE:
-                    break
+            if not self.lazy_moves:
+                self._legal_moves(state, last_move_reverse)
+            return (self._evaluate(state, h_type), solution)
 
-            # Line 10: WIN propagation — apply full sub-path at once
-            if best_val == WIN_VALUE:
-                state.apply_move(best_move)
-                solution.append(best_move)
-                for m in best_sub:
-                    state.apply_move(m)
-                    solution.append(m)
-                if state.is_win():
-                    return (WIN_VALUE, solution)
-                # Sub-path didn't fully complete; continue searching
-                sh_new = state.state_hash()
-                current_path = current_path | {sh_new}
-                legal = state.get_ordered_moves()
-                if not legal:
-                    return (WIN_VALUE, solution)
-                continue
+        legal = self._peek(self._legal_moves(state, last_move_reverse))
+        if legal is None:
+            return (self._evaluate(state, h_type), solution)
 
-            # Line 11-13: Local max / LOSS detection
-            current_val = Evaluator.evaluate(state, h_type)
-            if best_val == LOSS_VALUE or (z > 0 and best_val < current_val):
+        # === Lines 4-6: Cache check (ONCE on entry) ===
+        # Only n > 0 positions are recorded, so only those are probed
+        if n > 0:
+            cache = self.caches[h_idx]
+            cache_key = (state.canonical_hash()[0] if self.symmetric_cache
+                         else sh, n)
+            if cache.probe(cache_key):
                 if z == 0:
-                    return (current_val, solution)
+                    return (self._evaluate(state, h_type), solution)
                 else:
-                    # Switch to next heuristic; exclude current state from path
-                    # so the new call can start at this state without loop detection
-                    switch_path = current_path - frozenset({loop_sh})
+                    # Pass path WITHOUT current state; new call starts
+                    # at this state
                     val, sub = self._search(
                         state, h_idx + 1, self.n_levels[h_idx + 1],
-                        switch_path, top_level=top_level)
+                        path, top_level=top_level)
                     solution.extend(sub)
                     return (val, solution)
+            cache.store(cache_key)
 
-            # Line 14: Advance
-            reverse_sig = self._get_reverse_sig(best_move, state)
-            state.apply_move(best_move)
-            solution.append(best_move)
-            sh_new = state.state_hash()
+        # === Lines 7-14: Main while loop ===
+        # States this call visits stay on the shared path until it returns
+        mark = path.mark()
+        path.push(sh)
+
+        try:
+            while True:
+                # Track current state hash for heuristic switch
+                loop_sh = state.state_hash()
+
+                # Line 8-9: Evaluate children
+                best_val, best_move, best_sub = self._evaluate_children(
+                    state, legal, h_idx, n, path, top_level)
+
+                # Line 10: WIN propagation — apply full sub-path at once
+                if best_val == WIN_VALUE:
+                    self._commit(state, best_move)
+                    solution.append(best_move)
+                    for m in best_sub:
+                        self._commit(state, m)
+                        solution.append(m)
+                    if top_level:
+                        self._top_level_commit(state, solution[-1 - len(best_sub):],
+                                               best_val)
+                    if state.is_win():
+                        return (WIN_VALUE, solution)
+                    # Sub-path didn't fully complete; continue searching
+                    path.push(state.state_hash())
+                    legal = self._peek(self._legal_moves(state, None))
+                    if legal is None:
+                        return (WIN_VALUE, solution)
+                    continue
 
-            # Loop detection for new state
-            if sh_new in current_path:
-                return (Evaluator.evaluate(state, h_type), solution)
+                # Line 11-13: Local max / LOSS detection
+                current_val = self._evaluate(state, h_type)
+                if best_val == LOSS_VALUE or (z > 0 and best_val < current_val):
+                    if z == 0:
+                        return (current_val, solution)
+                    else:
+                        # Switch to next heuristic; exclude current state from path
+                        # so the new call can start at this state without loop detection
+                        hidden = path.exclude(loop_sh)
+                        val, sub = self._search(
+                            state, h_idx + 1, self.n_levels[h_idx + 1],
+                            path, top_level=top_level)
+                        path.include(loop_sh, hidden)
+                        solution.extend(sub)
+                        return (val, solution)
+
+                # Line 14: Advance
+                reverse_sig = self._get_reverse_sig(best_move, state)
+                self._commit(state, best_move)
+                solution.append(best_move)
+                if top_level:
+                    self._top_level_commit(state, solution[-1:], best_val)
+                sh_new = state.state_hash()
 
-            current_path = current_path | {sh_new}
-            self.nodes_searched += 1
+                # Loop detection for new state
+                if sh_new in path:
+                    return (self._evaluate(state, h_type), solution)
 
-            # Check termination conditions for new state
-            if state.is_win():
-                return (WIN_VALUE, solution)
+                path.push(sh_new)
+                self.nodes_searched += 1
 
-            if time.time() - self.start_time > self.max_time:
-                return (Evaluator.evaluate(state, h_type), solution)
+                # Check termination conditions for new state
+                if state.is_win():
+                    return (WIN_VALUE, solution)
 
-            legal = state.get_ordered_moves()
-            # Local loop prevention for next iteration
-            if reverse_sig is not None:
-                filtered = [m for m in legal
-                            if self._move_sig(m) != reverse_sig]
-                if filtered:
-                    legal = filtered
-            if not legal:
-                return (Evaluator.evaluate(state, h_type), solution)
+                if self._relaxed_dead(state, sh_new, n):
+                    return (LOSS_VALUE, solution)
+
+                if self._time_up():
+                    return (self._evaluate(state, h_type), solution)
+
+                legal = self._peek(self._legal_moves(state, reverse_sig))
+                if legal is None:
+                    return (self._evaluate(state, h_type), solution)
+        finally:
+            path.unwind(mark)
 
 # ==========================================
 # Main
@@ -765,9 +2590,18 @@ if __name__ == "__main__":
     game.display()
 
     print("Solving...")
-    solver = MultistageNestedRolloutSolver(game, max_time=time_limit, n0=n0, n1=n1)
+
+    def show_progress(ev):
+        if not ev['done']:
+            print(f"  {ev['elapsed']:5.1f}s  nodes={ev['nodes']}  "
+                  f"moves={ev['moves']}  foundation={ev['foundation']}/52",
+                  flush=True)
+
+    solver = MultistageNestedRolloutSolver(game, max_time=time_limit, n0=n0, n1=n1,
+                                           on_progress=show_progress,
+                                           progress_interval=5.0)
     solution = solver.solve()
-    elapsed = time.time() - solver.start_time
+    elapsed = solver.deadline.elapsed()
 
     final = solver.final_state
     fc = sum(len(f) for f in final.foundation)
@@ -0,0 +1,354 @@
+"""Multi-process search on top of MultistageNestedRolloutSolver.
+
+ParallelNestedRolloutSolver is root-parallel: at every step of the top-level
+loop the children of the current position are searched on a process pool
+instead of one after another. Results are merged by best value, and the
+first WIN cancels the rest of the round.
+
+solve_many() is the batch entry point: many deals, one per worker at a
+time, with results streamed back as they finish.
+
+    python parallel.py --start 0 --count 20 --max-time 10 --workers 8
+compares it with the serial solver on a few seeds.
+"""
+import argparse
+import math
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Iterable, Iterator, List, Optional, Union
+
+from main import (SolitaireState, CompactSolitaireState,
+                  MultistageNestedRolloutSolver, Deadline, Move, PathSet,
+                  WIN_VALUE, LOSS_VALUE)
+from solution_store import SolutionStore
+
+# Per-process solver used by pool workers (see _init_worker).
+_worker_solver: Optional['CancellableSolver'] = None
+# Per-process solver reused for every deal in solve_many().
+_batch_solver: Optional[MultistageNestedRolloutSolver] = None
+
+
+class CancellableSolver(MultistageNestedRolloutSolver):
+    """A solver that also stops when stop_event.is_set(), checked every
+    STOP_CHECK_INTERVAL time checks. stop_event is anything with is_set(),
+    e.g. a multiprocessing Event shared with the process that cancels.
+
+    ParallelNestedRolloutSolver's workers use search_child() to search one
+    top-level subtree per task, and give up when the round is won.
+    """
+
+    STOP_CHECK_INTERVAL = 256
+
+    def __init__(self, stop_event, n0, n1, solver_kw):
+        super().__init__(None, n0=n0, n1=n1, **solver_kw)
+        self.stop_event = stop_event
+        self._checks = 0
+
+    def _time_up(self) -> bool:
+        if super()._time_up():
+            return True
+        self._checks += 1
+        if self._checks >= self.STOP_CHECK_INTERVAL:
+            self._checks = 0
+            if self.stop_event.is_set():
+                self.deadline.cancel()  # sticky until the next task
+                return True
+        return False
+
+    def search_child(self, state, move: Move, h_idx: int, n: int,
+                     path: frozenset, time_left: float,
+                     nodes_left: Optional[int]):
+        self.deadline = Deadline(time_left, nodes_left, self.check_interval)
+        self.nodes_searched = 0
+        self._trail = [] if self.make_unmake else None
+        reverse = self._get_reverse_sig(move, state)
+        state.apply_move(move)
+        val, sub = self._search(state, h_idx, n - 1, PathSet(path),
+                                last_move_reverse=reverse)
+        return val, sub, self.nodes_searched
+
+
+def _init_worker(stop_event, n0, n1, solver_kw):
+    global _worker_solver
+    _worker_solver = CancellableSolver(stop_event, n0, n1, solver_kw)
+
+
+def _search_child(state, move, h_idx, n, path, time_left, nodes_left):
+    return _worker_solver.search_child(state, move, h_idx, n, path,
+                                       time_left, nodes_left)
+
+
+class ParallelNestedRolloutSolver(MultistageNestedRolloutSolver):
+    """Root-parallel variant: top-level children run on `workers` processes.
+
+    Each worker keeps its own caches for the whole solve(). Below the top
+    level the search is the serial one, so only the wall clock per top-level
+    step changes. Tie-breaking follows the serial order (first best child
+    in `legal`), except that any WIN ends the round as soon as it arrives.
+    Other keyword arguments configure both this solver and the workers'.
+    """
+
+    def __init__(self, root_state: SolitaireState,
+                 max_time: int = 60, n0: int = 1, n1: int = 1,
+                 workers: Optional[int] = None, **solver_kw):
+        super().__init__(root_state, max_time=max_time, n0=n0, n1=n1,
+                         **solver_kw)
+        self.solver_kw = solver_kw
+        self.workers = workers or os.cpu_count() or 1
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._stop = None
+
+    def solve(self) -> List[Move]:
+        ctx = mp.get_context()
+        self._stop = ctx.Event()
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=ctx, initializer=_init_worker,
+            initargs=(self._stop, self.n_levels[0], self.n_levels[1],
+                      self.solver_kw))
+        try:
+            return super().solve()
+        finally:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    def _evaluate_children(self, state, legal: Iterable[Move], h_idx: int,
+                           n: int, path: PathSet, top_level: bool):
+        if not top_level or self._time_up():
+            return super()._evaluate_children(state, legal, h_idx, n, path,
+                                              top_level)
+
+        legal = list(legal)
+        time_left = self.deadline.remaining()
+        nodes_left = self.deadline.remaining_nodes(self.nodes_searched)
+        self._stop.clear()
+        index = {}
+        for i, a in enumerate(legal):
+            # Children split the node budget. Each may use all of
+            # time_left, but the wait below stops them all at the parent's
+            # deadline, however late a queued child started.
+            share = None
+            if nodes_left is not None:
+                share = nodes_left // len(legal) + (i < nodes_left % len(legal))
+            fut = self._pool.submit(_search_child, state, a, h_idx, n,
+                                    path.snapshot(), time_left, share)
+            index[fut] = i
+
+        results = [None] * len(legal)
+        pending = set(index)
+        won = None
+        while pending and won is None:
+            left = self.deadline.remaining()
+            done, pending = wait(pending, return_when=FIRST_COMPLETED,
+                                 timeout=None if left == float('inf') else left)
+            if not done:
+                self.deadline.cancel()
+                break
+            for fut in done:
+                val, sub, nodes = fut.result()
+                self.nodes_searched += nodes
+                results[index[fut]] = (val, sub)
+                if val == WIN_VALUE and won is None:
+                    won = index[fut]
+        if pending:
+            # A win or the deadline: stop running subtrees, drop queued ones
+            self._stop.set()
+            for fut in pending:
+                fut.cancel()
+            for fut in wait(pending)[0]:
+                if not fut.cancelled():
+                    self.nodes_searched += fut.result()[2]
+        if won is not None:
+            return WIN_VALUE, legal[won], results[won][1]
+
+        best_val = LOSS_VALUE
+        best_move = None
+        best_sub = []
+        for a, res in zip(legal, results):
+            if res is not None and res[0] > best_val:
+                best_val, best_move, best_sub = res[0], a, res[1]
+        if best_move is None and None in results:
+            # Out of time before any child reported back (as in the serial
+            # loop); when every child lost, report the loss instead
+            best_move = legal[0]
+            best_val = self._evaluate(state, self.h_types[h_idx])
+        return best_val, best_move, best_sub
+
+
+def _init_batch_worker(n0, n1, solver_kw):
+    global _batch_solver
+    _batch_solver = MultistageNestedRolloutSolver(None, n0=n0, n1=n1, **solver_kw)
+
+
+def _store_params(max_time, n0, n1, solver_kw) -> dict:
+    """The solver settings a stored result is only valid for."""
+    params = {'max_time': max_time, 'n0': n0, 'n1': n1}
+    params.update((k, v) for k, v in solver_kw.items()
+                  if k != 'profile' and not callable(v))
+    return params
+
+
+def _solve_deal(solver, index, deal, max_time, compact, store=None,
+                params=None):
+    seed = None
+    if isinstance(deal, int):
+        seed = deal
+        deal = SolitaireState()
+        deal.deal_thoughtful(seed=seed)
+    elif isinstance(deal, (bytes, bytearray)):
+        deal = SolitaireState.from_deal(deal)
+    result = {
+        'index': index,
+        'seed': seed,
+        'budget': None if max_time is None else round(max_time, 3),
+        'cached': False,
+    }
+    if store is not None:
+        hit = store.get(deal, params)
+        if hit is not None:
+            result.update(hit, time=round(hit['time'], 3), cached=True)
+            return result
+    if compact and not isinstance(deal, CompactSolitaireState):
+        deal = CompactSolitaireState.from_state(deal)
+    solver.root = deal
+    solver.max_time = max_time
+    t0 = time.perf_counter()
+    moves = solver.solve()
+    elapsed = time.perf_counter() - t0
+    final = solver.final_state
+    result.update(win=final.is_win(), time=round(elapsed, 3),
+                  fc=sum(len(f) for f in final.foundation),
+                  nodes=solver.nodes_searched, moves=moves)
+    # Results are stored under the max_time cap in params. A loss searched
+    # on a smaller total_time share says nothing about that cap; a win does.
+    cap = params['max_time'] if store is not None else None
+    cut_short = max_time is not None and (cap is None or max_time < cap)
+    if store is not None and (result['win'] or not cut_short):
+        store.put(deal, params, moves, result['win'], result['fc'],
+                  result['nodes'], elapsed)
+    return result
+
+
+def _solve_batch_deal(index, deal, max_time, compact, store, params):
+    return _solve_deal(_batch_solver, index, deal, max_time, compact, store,
+                       params)
+
+
+def solve_many(deals: Iterable[Union[int, bytes, SolitaireState]],
+               max_time: float = 60, n0: int = 1, n1: int = 1,
+               workers: Optional[int] = None,
+               total_time: Optional[float] = None,
+               compact: bool = False,
+               store: Union[str, SolutionStore, None] = None,
+               **solver_kw) -> Iterator[dict]:
+    """Solve many deals, yielding a result dict per deal as it finishes.
+
+    `deals` are deal_thoughtful seeds, 52-byte deals (main.deal_bytes) or
+    ready-made states. Each worker builds one solver and reuses it, caches
+    included, for all of its deals; workers=1 solves in this process.
+    Without total_time every deal gets max_time. With it, a deal's budget
+    is fixed when it starts: the wall time left, shared by the workers
+    among the deals not finished yet, capped at max_time, so time saved on
+    easy deals goes to later ones.
+
+    Results arrive in completion order. 'index' is the deal's position in
+    `deals`, 'seed' is None unless the deal was a seed and 'moves' is the
+    solution. Other keyword arguments go to MultistageNestedRolloutSolver.
+
+    With a `store` (a SolutionStore or a database path) each deal is looked
+    up first under max_time, n0, n1 and the solver keywords, and searched
+    and recorded only if missing; 'cached' tells which results were
+    replayed, with the 'time' and 'nodes' of the original solve. A loss
+    searched on a total_time share below max_time is not recorded.
+    """
+    deals = list(deals)
+    if isinstance(store, str):
+        store = SolutionStore(store)
+    params = _store_params(max_time, n0, n1, solver_kw)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(deals)))
+    deadline = None if total_time is None else time.perf_counter() + total_time
+
+    def budget(unfinished: int) -> float:
+        if deadline is None:
+            return max_time
+        share = max(0.0, (deadline - time.perf_counter()) * workers / unfinished)
+        return share if max_time is None else min(max_time, share)
+
+    if workers == 1:
+        solver = MultistageNestedRolloutSolver(None, n0=n0, n1=n1, **solver_kw)
+        for i, deal in enumerate(deals):
+            yield _solve_deal(solver, i, deal, budget(len(deals) - i), compact,
+                              store, params)
+        return
+
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                               initargs=(n0, n1, solver_kw))
+    finished = False
+    try:
+        # Keep one deal per worker in flight so budgets follow the clock
+        pending = set()
+        next_i = 0
+        unfinished = len(deals)
+        while next_i < len(deals) or pending:
+            while next_i < len(deals) and len(pending) < workers:
+                pending.add(pool.submit(_solve_batch_deal, next_i, deals[next_i],
+                                        budget(unfinished), compact, store,
+                                        params))
+                next_i += 1
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                unfinished -= 1
+                yield fut.result()
+        finished = True
+    finally:
+        # An abandoned generator should not wait for deals still running
+        pool.shutdown(wait=finished, cancel_futures=True)
+
+
+def percentile(sorted_vals, q: float) -> float:
+    """Linear-interpolated percentile of an already sorted list."""
+    if not sorted_vals:
+        return 0.0
+    k = (len(sorted_vals) - 1) * q / 100
+    lo = math.floor(k)
+    hi = math.ceil(k)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (k - lo)
+
+
+def _run(solver_cls, seeds, **kw):
+    wins = 0
+    total = 0.0
+    for seed in seeds:
+        game = SolitaireState()
+        game.deal_thoughtful(seed=seed)
+        solver = solver_cls(game, **kw)
+        t0 = time.perf_counter()
+        solver.solve()
+        elapsed = time.perf_counter() - t0
+        total += elapsed
+        won = solver.final_state.is_win()
+        wins += won
+        print(f"  Seed {seed:3d}: {'WIN' if won else 'LOSS'} {elapsed:5.1f}s  "
+              f"nodes={solver.nodes_searched}", flush=True)
+    return wins, total
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Serial vs root-parallel solver')
+    ap.add_argument('--start', type=int, default=0)
+    ap.add_argument('--count', type=int, default=10)
+    ap.add_argument('--max-time', type=float, default=10)
+    ap.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = ap.parse_args()
+
+    seeds = range(args.start, args.start + args.count)
+    print('Serial:')
+    s_wins, s_time = _run(MultistageNestedRolloutSolver, seeds,
+                          max_time=args.max_time)
+    print(f'Root-parallel ({args.workers} workers):')
+    p_wins, p_time = _run(ParallelNestedRolloutSolver, seeds,
+                          max_time=args.max_time, workers=args.workers)
+    print(f'\nSerial:   {s_wins}/{len(seeds)} wins, {s_time:.1f}s total')
+    print(f'Parallel: {p_wins}/{len(seeds)} wins, {p_time:.1f}s total '
+          f'(speedup {s_time / p_time:.2f}x)')
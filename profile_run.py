@@ -1,10 +1,21 @@
 import cProfile
 import pstats
+import sys
 from main import SolitaireState, MultistageNestedRolloutSolver
 
+# Built-in counters by default; pass --cprofile for a full cProfile run
+# (much slower, but with every function).
+use_cprofile = '--cprofile' in sys.argv
+
 game = SolitaireState()
 game.deal_thoughtful(seed=0)
-solver = MultistageNestedRolloutSolver(game, max_time=10, n0=1, n1=1)
+solver = MultistageNestedRolloutSolver(game, max_time=10, n0=1, n1=1,
+                                       profile=not use_cprofile)
+
+if not use_cprofile:
+    solver.solve()
+    print(solver.stats.report())
+    sys.exit()
 
 cProfile.run('solver.solve()', '/tmp/solitaire_profile')
 
@@ -0,0 +1,394 @@
+"""Asyncio solver service: JSON-lines requests, solved on a process pool.
+
+Each request is one JSON object per line, answered by one line carrying
+the same "id" (answers arrive in completion order):
+
+    {"op": "solve", "id": "a", "deal": 42, "params": {"max_time": 5},
+     "deadline": 3}
+    {"op": "cancel", "id": "a"}
+    {"op": "stats"}
+
+"deal" is a deal_thoughtful seed or the 52-byte deal encoding in hex
+(main.deal_bytes). "params" are solver keywords (see JOB_PARAMS). The
+optional "deadline" is in seconds from arrival, queueing included: the
+search is given what is left when it starts, less DEADLINE_MARGIN, and the
+request is answered {"status": "timeout"} if no result is in by then.
+
+A solve answer has "status": "done", "win", "fc", "nodes", "time" and
+"moves" (packed, see Move.unpack). "shared" is true when identical
+requests (same deal and params) were in flight together and got one
+search; a request joins a running search only if it is at least as long
+as the request's own and ends by its deadline. Cancelling a queued job drops it; a running one
+stops at its next time check, unless other requests still wait for it.
+
+    python service.py --workers 4                 # stdin/stdout
+    python service.py --socket /tmp/solver.sock   # Unix socket
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Deque, Dict, List, Optional, Tuple
+
+from main import SolitaireState, CompactSolitaireState, deal_bytes
+from parallel import CancellableSolver, percentile
+from solution_store import params_key
+
+# Solver keywords a request may set; n0, n1 and compact are handled here
+JOB_PARAMS = {'max_time', 'max_nodes', 'n0', 'n1', 'compact', 'seed',
+              'make_unmake', 'cache_capacity', 'cache_policy',
+              'eval_cache_capacity', 'relaxed_prune', 'anytime',
+              'lazy_moves', 'symmetric_cache'}
+DEFAULT_MAX_TIME = 60.0
+# Seconds a deadline-bound search stops early, to answer in time
+DEADLINE_MARGIN = 0.1
+
+# Per-process cancel flags, one per pool slot (see _init_worker)
+_cancel_flags = None
+
+
+class _SlotFlag:
+    """Event-like view of one cancel flag, as CancellableSolver expects."""
+
+    def __init__(self, slot: int):
+        self.slot = slot
+
+    def is_set(self) -> bool:
+        return bool(_cancel_flags[self.slot])
+
+
+def _init_worker(flags):
+    global _cancel_flags
+    _cancel_flags = flags
+
+
+def _run_job(slot: int, deal: bytes, params: dict,
+             max_time: Optional[float]) -> dict:
+    kw = dict(params)
+    n0 = kw.pop('n0', 1)
+    n1 = kw.pop('n1', 1)
+    cls = CompactSolitaireState if kw.pop('compact', False) else SolitaireState
+    kw['max_time'] = max_time
+    solver = CancellableSolver(_SlotFlag(slot), n0, n1, kw)
+    solver.root = cls.from_deal(deal)
+    t0 = time.perf_counter()
+    moves = solver.solve()
+    final = solver.final_state
+    return {'win': final.is_win(),
+            'fc': sum(final.foundation_heights()),
+            'nodes': solver.nodes_searched,
+            'time': round(time.perf_counter() - t0, 3),
+            'moves': [m.pack() for m in moves]}
+
+
+class _Job:
+    """One search, shared by every request waiting for it."""
+
+    def __init__(self, key, deal: bytes, params: dict):
+        self.key = key
+        self.deal = deal
+        self.params = params
+        # request id -> (future, absolute deadline or None)
+        self.waiters: Dict[str, Tuple[asyncio.Future, Optional[float]]] = {}
+        self.slot: Optional[int] = None
+        # Search seconds it was dispatched with and the loop time it ends
+        # by (None: unlimited)
+        self.max_time: Optional[float] = None
+        self.end: Optional[float] = None
+
+    def serves(self, max_time: Optional[float],
+               deadline: Optional[float]) -> bool:
+        """Whether this running search is as good as one started now with
+        `max_time` seconds, and done by `deadline`."""
+        if self.max_time is not None and (max_time is None
+                                          or self.max_time < max_time):
+            return False
+        return deadline is None or (self.end is not None
+                                    and self.end + DEADLINE_MARGIN <= deadline)
+
+
+def _budget(params: dict, deadline: Optional[float],
+            now: float) -> Optional[float]:
+    """Search seconds for `params`, capped by an absolute deadline."""
+    max_time = params.get('max_time', DEFAULT_MAX_TIME)
+    if deadline is not None:
+        left = max(0.0, deadline - now - DEADLINE_MARGIN)
+        max_time = left if max_time is None else min(max_time, left)
+    return max_time
+
+
+def check_id(rid):
+    """Request ids are strings, integers or null."""
+    if rid is not None and (isinstance(rid, bool)
+                            or not isinstance(rid, (str, int))):
+        raise ValueError('id must be a string, an integer or null')
+
+
+def parse_deal(deal) -> bytes:
+    if isinstance(deal, int) and not isinstance(deal, bool):
+        return deal_bytes(deal)
+    if isinstance(deal, str):
+        data = bytes.fromhex(deal)
+        SolitaireState.from_deal(data)  # validates
+        return data
+    raise ValueError('deal must be a seed or a hex deal encoding')
+
+
+class SolverService:
+    """Job queue in front of a bounded process pool.
+
+    At most `workers` searches run at once; up to max_queue more wait.
+    Use from a running event loop: `await service.solve(request)`.
+    """
+
+    def __init__(self, workers: Optional[int] = None, max_queue: int = 1000,
+                 history: int = 1000):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self._flags = mp.Array('b', self.workers, lock=False)
+        self._pool = ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                         initargs=(self._flags,))
+        self._free = list(range(self.workers))
+        self._queue: Deque[_Job] = deque()
+        # (deal, params) -> its queued and running jobs
+        self._inflight: Dict[tuple, List[_Job]] = {}
+        self._requests: Dict[str, _Job] = {}
+        self._latencies: Deque[float] = deque(maxlen=history)
+        self.completed = 0
+        self.shared = 0
+
+    async def solve(self, request: dict) -> dict:
+        """Answer one solve request (see the module docstring)."""
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        rid = request.get('id')
+        try:
+            check_id(rid)
+            if rid in self._requests:
+                raise ValueError(f'id {rid!r} is already in flight')
+            deal = parse_deal(request.get('deal'))
+            params = dict(request.get('params') or {})
+            unknown = set(params) - JOB_PARAMS
+            if unknown:
+                raise ValueError(f'unknown params: {sorted(unknown)}')
+            timeout = request.get('deadline')
+            if timeout is not None and (
+                    isinstance(timeout, bool)
+                    or not isinstance(timeout, (int, float))
+                    or not timeout >= 0):  # NaN included
+                raise ValueError('deadline must be a number >= 0 or null')
+        except (ValueError, TypeError) as e:
+            return {'id': rid, 'status': 'error', 'error': str(e)}
+
+        key = (deal, params_key(params))
+        deadline = None if timeout is None else t0 + timeout
+        # Join a queued job (its budget is set at dispatch), or a running
+        # one as long as this request's own search and done in time
+        max_time = _budget(params, deadline, t0)
+        job = next((j for j in self._inflight.get(key, ())
+                    if j.slot is None or j.serves(max_time, deadline)), None)
+        if job is None:
+            if len(self._queue) >= self.max_queue:
+                return {'id': rid, 'status': 'error', 'error': 'queue full'}
+            job = _Job(key, deal, params)
+            self._inflight.setdefault(key, []).append(job)
+            self._queue.append(job)
+        else:
+            self.shared += 1
+        fut = loop.create_future()
+        job.waiters[rid] = (fut, deadline)
+        self._requests[rid] = job
+        self._dispatch()
+
+        try:
+            if timeout is None:
+                resp = await fut
+            else:
+                resp = await asyncio.wait_for(asyncio.shield(fut), timeout)
+        except asyncio.TimeoutError:
+            self._detach(rid)
+            resp = {'status': 'timeout'}
+        except asyncio.CancelledError:
+            self._detach(rid)
+            raise
+        self._latencies.append(loop.time() - t0)
+        return dict(resp, id=rid)
+
+    def cancel(self, rid) -> bool:
+        """Answer request `rid` with {"status": "cancelled"}. False if it
+        is not in flight. Raises ValueError for an invalid id."""
+        check_id(rid)
+        if rid not in self._requests:
+            return False
+        fut = self._detach(rid)
+        if not fut.done():
+            fut.set_result({'status': 'cancelled'})
+        return True
+
+    def stats(self) -> dict:
+        lat = sorted(self._latencies)
+        return {'queued': len(self._queue),
+                'running': self.workers - len(self._free),
+                'waiting': len(self._requests),
+                'completed': self.completed,
+                'shared': self.shared,
+                'latency': {f'p{q}': round(percentile(lat, q), 3)
+                            for q in (50, 90, 99)}}
+
+    def close(self):
+        for slot in range(self.workers):
+            self._flags[slot] = 1
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def _detach(self, rid) -> asyncio.Future:
+        """Drop request `rid` from its job; a job nobody waits for is
+        dequeued, or stopped if running."""
+        job = self._requests.pop(rid)
+        fut, _ = job.waiters.pop(rid)
+        if not job.waiters:
+            self._forget(job)
+            if job.slot is None:
+                self._queue.remove(job)
+            else:
+                self._flags[job.slot] = 1
+        return fut
+
+    def _forget(self, job: _Job):
+        """Take `job` out of _inflight, so no new request joins it."""
+        jobs = self._inflight[job.key]
+        jobs.remove(job)
+        if not jobs:
+            del self._inflight[job.key]
+
+    def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while self._queue and self._free:
+            job = self._queue.popleft()
+            deadlines = [d for _, d in job.waiters.values()]
+            now = loop.time()
+            job.max_time = _budget(job.params, None if None in deadlines
+                                   else max(deadlines), now)
+            job.end = None if job.max_time is None else now + job.max_time
+            job.slot = self._free.pop()
+            self._flags[job.slot] = 0
+            fut = loop.run_in_executor(self._pool, _run_job, job.slot, job.deal,
+                                       job.params, job.max_time)
+            fut.add_done_callback(lambda f, job=job: self._finish(job, f))
+
+    def _finish(self, job: _Job, fut: asyncio.Future):
+        self._free.append(job.slot)
+        if job.waiters:
+            self._forget(job)
+        if fut.cancelled():
+            resp = {'status': 'cancelled'}
+        elif fut.exception() is not None:
+            resp = {'status': 'error', 'error': repr(fut.exception())}
+        else:
+            resp = dict(fut.result(), status='done',
+                        shared=len(job.waiters) > 1)
+        for rid, (waiter, _) in job.waiters.items():
+            self._requests.pop(rid, None)
+            if not waiter.done():
+                waiter.set_result(resp)
+        self.completed += 1
+        self._dispatch()
+
+
+async def serve(service: SolverService, reader: asyncio.StreamReader,
+                write) -> None:
+    """Answer the JSON-lines requests from `reader` until EOF; write(line)
+    sends one answer."""
+    tasks = set()
+
+    async def answer(request):
+        write(json.dumps(await service.solve(request)))
+
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+            op = request.get('op', 'solve')
+        except (ValueError, AttributeError) as e:
+            write(json.dumps({'status': 'error', 'error': f'bad request: {e}'}))
+            continue
+        if op == 'solve':
+            task = asyncio.ensure_future(answer(request))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            await asyncio.sleep(0)  # let it enqueue before the next line
+        elif op == 'cancel':
+            try:
+                if not service.cancel(request.get('id')):
+                    raise ValueError('no such request')
+            except ValueError as e:
+                write(json.dumps({'id': request.get('id'), 'status': 'error',
+                                  'error': str(e)}))
+        elif op == 'stats':
+            write(json.dumps(dict(service.stats(), op='stats')))
+        else:
+            write(json.dumps({'id': request.get('id'), 'status': 'error',
+                              'error': f'unknown op {op!r}'}))
+    if tasks:
+        await asyncio.wait(tasks)
+
+
+async def _serve_stdio(service: SolverService):
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader),
+                                 sys.stdin)
+
+    def write(line: str):
+        sys.stdout.write(line + '\n')
+        sys.stdout.flush()
+
+    await serve(service, reader, write)
+
+
+async def _serve_socket(service: SolverService, path: str):
+    async def client(reader, writer):
+        try:
+            await serve(service, reader,
+                        lambda line: writer.write(line.encode() + b'\n'))
+            await writer.drain()
+        finally:
+            writer.close()
+
+    server = await asyncio.start_unix_server(client, path=path)
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    ap.add_argument('--max-queue', type=int, default=1000,
+                    help='jobs waiting for a worker before requests are refused')
+    ap.add_argument('--socket', metavar='PATH',
+                    help='listen on a Unix socket instead of stdin/stdout')
+    args = ap.parse_args(argv)
+
+    service = SolverService(args.workers, args.max_queue)
+    try:
+        if args.socket:
+            asyncio.run(_serve_socket(service, args.socket))
+        else:
+            asyncio.run(_serve_stdio(service))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == '__main__':
+    main()
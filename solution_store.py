@@ -0,0 +1,236 @@
+"""Persistent store of solver results, and a binary solution file format.
+
+Results live in an SQLite database keyed by the position searched and the
+solver parameters, so a batch run can skip deals that were already solved
+with the same settings, by this run or an earlier one. The database is in
+WAL mode: readers never block, and writers from several worker processes
+queue on SQLite's lock (each put is one short transaction, retried for up
+to `timeout` seconds).
+
+    store = SolutionStore('solutions.db')
+    hit = store.get(state, params)
+    if hit is None:
+        moves = solver.solve()
+        store.put(state, params, moves, win, fc, nodes, elapsed)
+
+Move lists are stored as packed uint32s (Move.pack()). A single solution
+can also be written to a file with write_solution() and checked with
+verify_solution(), which replays it move by move:
+
+    python solution_store.py deal.ksol
+"""
+import json
+import os
+import random
+import sqlite3
+import struct
+import sys
+import time
+from typing import List, Optional, Sequence, Tuple, Union
+
+from main import (SolitaireState, CompactSolitaireState, Move,
+                  SUIT_SYMMETRIES, permute_move, _BUF_SIZE)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    position BLOB NOT NULL,
+    params TEXT NOT NULL,
+    win INTEGER NOT NULL,
+    fc INTEGER NOT NULL,
+    moves BLOB NOT NULL,
+    nodes INTEGER NOT NULL,
+    time REAL NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (position, params)
+) WITHOUT ROWID
+"""
+
+# On a repeated key keep the better result: a win, else more cards home.
+_UPSERT = """
+INSERT INTO results (position, params, win, fc, moves, nodes, time, created)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (position, params) DO UPDATE SET
+    win = excluded.win, fc = excluded.fc, moves = excluded.moves,
+    nodes = excluded.nodes, time = excluded.time, created = excluded.created
+WHERE (excluded.win, excluded.fc) > (results.win, results.fc)
+"""
+
+
+def position_key(state: Union[SolitaireState, CompactSolitaireState]) -> bytes:
+    """Canonical bytes of a position: its CompactSolitaireState buffer.
+
+    The buffer has a fixed layout with unused slots zeroed, so equal
+    positions give equal keys whichever backend holds them.
+    """
+    if isinstance(state, CompactSolitaireState):
+        state = state.to_state()
+    return bytes(CompactSolitaireState.from_state(state).buf)
+
+
+def canonical_position(state) -> Tuple[bytes, int]:
+    """(key, k): the smallest position_key() among the suit-symmetric
+    images of `state` and the symmetry k that gives it (see
+    main.SUIT_SYMMETRIES; permute_move(m, k) maps moves either way)."""
+    keys = [position_key(state.permute_suits(k))
+            for k in range(len(SUIT_SYMMETRIES))]
+    key = min(keys)
+    return key, keys.index(key)
+
+
+def params_key(params: dict) -> str:
+    return json.dumps(params, sort_keys=True, separators=(',', ':'))
+
+
+def encode_moves(moves: Sequence[Move]) -> bytes:
+    """Little-endian uint32 array of packed moves."""
+    return struct.pack(f'<{len(moves)}I', *(m.pack() for m in moves))
+
+
+def decode_moves(data: bytes) -> List[Move]:
+    return [Move.unpack(p) for p in struct.unpack(f'<{len(data) // 4}I', data)]
+
+
+# Solution file: header, the start position (see position_key), then the
+# move count and the packed moves, all little-endian.
+SOLUTION_MAGIC = b'KSOL'
+SOLUTION_VERSION = 1
+_HEADER = struct.Struct('<4sBH')
+_COUNT = struct.Struct('<I')
+
+
+def write_solution(path: str, state, moves: Sequence[Move]):
+    pos = position_key(state)
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(SOLUTION_MAGIC, SOLUTION_VERSION, len(pos)))
+        f.write(pos)
+        f.write(_COUNT.pack(len(moves)))
+        f.write(encode_moves(moves))
+
+
+def read_solution(path: str) -> Tuple[CompactSolitaireState, List[Move]]:
+    """The start position and moves of a solution file."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, pos_len = _HEADER.unpack_from(data)
+    if magic != SOLUTION_MAGIC or version != SOLUTION_VERSION:
+        raise ValueError(f'{path}: not a version {SOLUTION_VERSION} solution file')
+    off = _HEADER.size
+    if pos_len != _BUF_SIZE or len(data) < off + pos_len + _COUNT.size:
+        raise ValueError(f'{path}: bad position record')
+    state = CompactSolitaireState()
+    state.buf = bytearray(data[off:off + pos_len])
+    state.rehash()
+    off += pos_len
+    (count,) = _COUNT.unpack_from(data, off)
+    off += _COUNT.size
+    moves = decode_moves(data[off:off + 4 * count])
+    if len(moves) != count:
+        raise ValueError(f'{path}: truncated, {len(moves)} of {count} moves')
+    return state, moves
+
+
+def verify_solution(state, moves: Sequence[Union[Move, int]]) -> bool:
+    """Replay `moves` (Move objects or packed ints) from `state`.
+
+    Every move must be legal where it is played, K+ stock turns included,
+    and the last one must win. `state` itself is not modified.
+    """
+    state = state.clone()
+    rng = random.Random(0)  # move order is irrelevant; spare the global RNG
+    for m in moves:
+        packed = m if isinstance(m, int) else m.pack()
+        legal = {a.pack(): a for a in state.get_ordered_moves(rng)}
+        if packed not in legal:
+            return False
+        state.apply_move(legal[packed])
+    return state.is_win()
+
+
+class SolutionStore:
+    """SQLite-backed results keyed by (position, solver params).
+
+    Safe to pass to worker processes: the connection is opened lazily in
+    each process and never shared across a fork.
+
+    With symmetric=True positions are stored in canonical suit orientation
+    (canonical_position()), so a deal and its suit-swapped images share one
+    entry; moves are mapped to and from the caller's orientation. Use one
+    setting per database: the two kinds of keys do not find each other.
+    """
+
+    def __init__(self, path: str, timeout: float = 30.0,
+                 symmetric: bool = False):
+        self.path = path
+        self.timeout = timeout
+        self.symmetric = symmetric
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid = None
+
+    def __getstate__(self):
+        return {'path': self.path, 'timeout': self.timeout,
+                'symmetric': self.symmetric}
+
+    def __setstate__(self, d):
+        self.__init__(d['path'], d['timeout'], d.get('symmetric', False))
+
+    def _key(self, state) -> Tuple[bytes, int]:
+        if self.symmetric:
+            return canonical_position(state)
+        return position_key(state), 0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout,
+                                   isolation_level=None)
+            conn.execute(f'PRAGMA busy_timeout = {int(self.timeout * 1000)}')
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.execute(_SCHEMA)
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, state, params: dict) -> Optional[dict]:
+        """The stored result for `state` under `params`, or None.
+
+        The dict has 'win', 'fc', 'moves' (Move objects), 'nodes' and
+        'time' as recorded by the solve that produced it.
+        """
+        key, k = self._key(state)
+        row = self._db().execute(
+            'SELECT win, fc, moves, nodes, time FROM results '
+            'WHERE position = ? AND params = ?',
+            (key, params_key(params))).fetchone()
+        if row is None:
+            return None
+        win, fc, moves, nodes, elapsed = row
+        moves = decode_moves(moves)
+        if k:
+            moves = [permute_move(m, k) for m in moves]
+        return {'win': bool(win), 'fc': fc, 'moves': moves,
+                'nodes': nodes, 'time': elapsed}
+
+    def put(self, state, params: dict, moves: List[Move], win: bool, fc: int,
+            nodes: int, elapsed: float):
+        """Record a result. An existing one is replaced only if worse."""
+        key, k = self._key(state)
+        if k:
+            moves = [permute_move(m, k) for m in moves]
+        self._db().execute(_UPSERT, (
+            key, params_key(params), int(win), fc,
+            encode_moves(moves), nodes, elapsed, time.time()))
+
+    def __len__(self) -> int:
+        return self._db().execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+
+if __name__ == '__main__':
+    for arg in sys.argv[1:]:
+        start, solution = read_solution(arg)
+        ok = verify_solution(start, solution)
+        print(f"{arg}: {len(solution)} moves, {'wins' if ok else 'INVALID'}")